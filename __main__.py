@@ -1,9 +1,14 @@
 from os import name
 import utils
 import argparse
+import json
 
 from simulation_classes import Grid
 from evo_classes import Population
+from islands import IslandModel
+from instrumentation import profiler
+from network import NetworkReduction
+from submission import write_submission
 
 
 def main(
@@ -18,37 +23,140 @@ def main(
     fig_title="Default Run",
     replace=False,
     mutation_mode="schedule",
+    engine="tick",
+    batch_size=None,
+    n_workers=None,
+    seed=None,
+    cache_size=None,
+    checkpoint_memory=None,
+    prune=False,
+    proxy_horizon=None,
+    proxy_cars=None,
+    promote_fraction=0.5,
+    calibrate_every=10,
+    init="random",
+    reduce=False,
+    steady_state=False,
+    replacement="worst",
+    islands=None,
+    migration_interval=10,
+    migrants=1,
+    topology="ring",
+    checkpoint=None,
+    checkpoint_every=None,
+    checkpoint_seconds=None,
+    resume=None,
+    profile=False,
+    profile_file=None,
+    submission=None,
 ):
+    # Enable timing from the start, so that parsing is included.
+    profiler.enabled = profile
     data_file = ""
     if use_simulated_data:
         data_file = "./data/complex_test.in"
         if create_new_file:
             g = Grid(100, simple_scenario=False)
-            g.gen_hashcode_string(
+            g.gen_hashcode_file(
+                data_file,
                 duration=700,
                 num_cars=100,
                 hops=12,
                 bonus_points=1000,
-                save=True,
-                name="complex_test.in",
                 min_neighbors=3,
                 max_neighbors=10,
             )
     else:
         data_file = "./data/hashcode.in"
-    sim, intersection_dict = utils.create_default_sim_from_file(data_file)
-    pop = Population(
-        sim,
-        intersection_dict,
+    network = utils.load_network(data_file)
+    if reduce:
+        reduction = NetworkReduction(network)
+        network = reduction.network
+        print(
+            f"Reduced genome from {len(reduction.full.free_slots)} "
+            f"to {len(network.free_slots)} timings"
+        )
+    if len(network.free_slots) == 0:
+        # Every timing is fixed by the network, so there is nothing to evolve.
+        print("All timings are fixed, skipping evolution")
+        if submission is not None:
+            with open(submission, "w") as f:
+                write_submission(f, network, [])
+        return 0
+
+    params = dict(
         gen_size=gen_size,
         candidate_size=candidate_size,
         timing_cap=timing_cap,
         mutation_rate=mutation_rate,
         tournament_size=tournament_size,
         replace_parents=replace,
+        engine=engine,
+        batch_size=batch_size,
+        n_workers=n_workers,
+        seed=seed,
+        cache_size=cache_size,
+        checkpoint_memory=checkpoint_memory,
+        prune=prune,
+        proxy_horizon=proxy_horizon,
+        proxy_cars=proxy_cars,
+        promote_fraction=promote_fraction,
+        calibrate_every=calibrate_every,
+        init=init,
     )
-    b, w, m = pop.run(num_generations)
-    utils.plot_evolutionary_run(b, w, m, fig_title=fig_title)
+    if islands is not None:
+        model = IslandModel(
+            network,
+            [params] * islands,
+            migration_interval=migration_interval,
+            nr_migrants=migrants,
+            topology=topology,
+            seed=seed,
+        )
+        island_best, global_best = model.run(num_generations)
+        if submission is not None:
+            with open(submission, "w") as f:
+                write_submission(f, network, model.best()[0])
+        model.close()
+        print(
+            f"Global best: {global_best[-1]}, "
+            f"per island: {[int(best[-1]) for best in island_best]}"
+        )
+        utils.plot_island_run(island_best, global_best, fig_title=fig_title)
+        return 0
+
+    sim, intersection_dict = utils.create_sim_from_network(network)
+    pop = Population(sim, intersection_dict, resume_from=resume, **params)
+    if steady_state:
+        # Spend the same number of evaluations as the generational run would.
+        times, best = pop.run_steady_state(
+            num_generations * candidate_size, replacement=replacement
+        )
+    else:
+        # A resumed run continues until num_generations are done in total, and
+        # keeps checkpointing to the file it was resumed from by default.
+        if checkpoint is None:
+            checkpoint = resume
+        pop.run(
+            max(0, num_generations - pop.generation),
+            checkpoint_file=checkpoint,
+            checkpoint_every=checkpoint_every,
+            checkpoint_seconds=checkpoint_seconds,
+            profile_file=profile_file,
+        )
+        b, w, m = pop.best_run, pop.worst_run, pop.mean_run
+    pop.close()
+    if submission is not None:
+        with open(submission, "w") as f:
+            write_submission(f, network, pop.emigrants(1)[0][0])
+    if pop.run_stats:
+        print(pop.run_stats)
+    if steady_state:
+        utils.plot_steady_state_run(times, best, fig_title=fig_title)
+    else:
+        utils.plot_evolutionary_run(b, w, m, fig_title=fig_title)
+    if profile:
+        print(json.dumps(profiler.report(), indent=2))
 
     return 0
 
@@ -131,7 +239,210 @@ if __name__ == "__main__":
         help="string controlling the mode of mutation. Needs to be either 'schedule' or 'individual'.",
     )
 
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        default="tick",
+        type=str,
+        help="Simulation engine used for evaluation. Needs to be either 'tick', 'vector' or 'event'.",
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        dest="batch_size",
+        default=None,
+        type=int,
+        help="Number of individuals the 'vector' engine simulates together. Evaluates one at a time if not set.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        default=None,
+        type=int,
+        help="Number of worker processes used to evaluate individuals in parallel. Evaluates in the main process if not set.",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        default=None,
+        type=int,
+        help="Seed for the random number generator of the evolutionary algorithm.",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        default=None,
+        type=int,
+        help="Number of genome fitnesses remembered to skip simulating duplicates. Disabled if not set.",
+    )
+
+    parser.add_argument(
+        "--checkpoint_memory",
+        dest="checkpoint_memory",
+        default=None,
+        type=int,
+        help="Megabytes of simulation checkpoints kept to re-evaluate children from their parent's run. Needs the 'vector' engine.",
+    )
+
+    parser.add_argument(
+        "--prune",
+        dest="prune",
+        action="store_true",
+        help="Abort simulating a child once its best possible score cannot beat the worst individual.",
+    )
+    parser.set_defaults(prune=False)
+
+    parser.add_argument(
+        "--reduce",
+        dest="reduce",
+        action="store_true",
+        help="Evolve only the timings of streets that cars wait on at intersections with more than one such street.",
+    )
+    parser.set_defaults(reduce=False)
+
+    parser.add_argument(
+        "--init",
+        dest="init",
+        default="random",
+        type=str,
+        help="How the initial population is generated. Needs to be either 'random', 'unused' or 'demand'.",
+    )
+
+    parser.add_argument(
+        "--proxy_horizon",
+        dest="proxy_horizon",
+        default=None,
+        type=float,
+        help="Fraction of the iterations children are screened on before full evaluation. No screening if not set.",
+    )
+    parser.add_argument(
+        "--proxy_cars",
+        dest="proxy_cars",
+        default=None,
+        type=float,
+        help="Fraction of the cars children are screened on before full evaluation. No screening if not set.",
+    )
+    parser.add_argument(
+        "--promote_fraction",
+        dest="promote_fraction",
+        default=0.5,
+        type=float,
+        help="Fraction of the screened children that is evaluated in full.",
+    )
+    parser.add_argument(
+        "--calibrate_every",
+        dest="calibrate_every",
+        default=10,
+        type=int,
+        help="Number of generations between evaluating all screened children in full, to measure how well the proxy ranks them.",
+    )
+
+    parser.add_argument(
+        "--steady_state",
+        dest="steady_state",
+        action="store_true",
+        help="Evolve without generations, inserting every child as soon as it is evaluated.",
+    )
+    parser.set_defaults(steady_state=False)
+    parser.add_argument(
+        "--replacement",
+        dest="replacement",
+        default="worst",
+        type=str,
+        help="Who a steady-state child replaces. Needs to be either 'worst' or 'tournament'.",
+    )
+
+    parser.add_argument(
+        "--islands",
+        dest="islands",
+        default=None,
+        type=int,
+        help="Number of island populations evolving in their own processes. Uses a single population if not set.",
+    )
+    parser.add_argument(
+        "--migration_interval",
+        dest="migration_interval",
+        default=10,
+        type=int,
+        help="Number of generations between migrations between islands.",
+    )
+    parser.add_argument(
+        "--migrants",
+        dest="migrants",
+        default=1,
+        type=int,
+        help="Number of best individuals each island sends to each neighbour.",
+    )
+    parser.add_argument(
+        "--topology",
+        dest="topology",
+        default="ring",
+        type=str,
+        help="Migration topology between islands. Needs to be either 'ring' or 'full'.",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        default=None,
+        type=str,
+        help="File the population is checkpointed to, so the run can be resumed. No checkpoints if not set.",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        dest="checkpoint_every",
+        default=None,
+        type=int,
+        help="Number of generations between checkpoints.",
+    )
+    parser.add_argument(
+        "--checkpoint_seconds",
+        dest="checkpoint_seconds",
+        default=None,
+        type=float,
+        help="Seconds of wall-clock time between checkpoints.",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        default=None,
+        type=str,
+        help="Checkpoint file to resume a run from, with the same settings it was started with.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="Time every phase of the run and count simulation events, and print the totals at the end.",
+    )
+    parser.set_defaults(profile=False)
+    parser.add_argument(
+        "--profile_file",
+        dest="profile_file",
+        default=None,
+        type=str,
+        help="File the phase timings so far are appended to as JSON after every generation.",
+    )
+
+    parser.add_argument(
+        "--submission",
+        dest="submission",
+        default=None,
+        type=str,
+        help="File the schedules of the best individual are written to in hashcode output format, leaving out streets with a timing of 0.",
+    )
+
     args = parser.parse_args()
+    # Only generational runs of a single population are checkpointed.
+    if args.islands is not None or args.steady_state:
+        for option in ("checkpoint", "checkpoint_every", "checkpoint_seconds", "resume"):
+            if getattr(args, option) is not None:
+                parser.error(
+                    f"--{option} cannot be combined with --islands or --steady_state."
+                )
 
     main(
         use_simulated_data=not (args.hashcode),
@@ -144,4 +455,30 @@ if __name__ == "__main__":
         tournament_size=args.tour_size,
         replace=args.replace,
         fig_title=args.fig_title,
+        engine=args.engine,
+        batch_size=args.batch_size,
+        n_workers=args.workers,
+        seed=args.seed,
+        cache_size=args.cache_size,
+        checkpoint_memory=args.checkpoint_memory,
+        prune=args.prune,
+        proxy_horizon=args.proxy_horizon,
+        proxy_cars=args.proxy_cars,
+        promote_fraction=args.promote_fraction,
+        calibrate_every=args.calibrate_every,
+        init=args.init,
+        reduce=args.reduce,
+        steady_state=args.steady_state,
+        replacement=args.replacement,
+        islands=args.islands,
+        migration_interval=args.migration_interval,
+        migrants=args.migrants,
+        topology=args.topology,
+        checkpoint=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        checkpoint_seconds=args.checkpoint_seconds,
+        resume=args.resume,
+        profile=args.profile,
+        profile_file=args.profile_file,
+        submission=args.submission,
     )
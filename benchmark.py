@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for parsing, simulation and the EA, run from the command line.
+
+Measures every input file and Grid generated city of increasing size, and writes
+the results as JSON, so that runs on different versions can be compared with
+--compare. Large random cities are only benchmarked when --city_sizes is given.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from evo_classes import ENGINES, Population
+from network import RoadNetwork
+from simulation_classes import Grid, Simulation
+import utils
+
+
+def time_call(function, repeats):
+    # Return the fastest of several timings of a call, in seconds.
+    best = float("inf")
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse(filename, repeats=5):
+    # Measure parse_input without the binary cache, and compiling the network
+    # without its cache file (cold) and loading it from there (warm).
+    cache_file = filename + ".npz"
+
+    def cold():
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        RoadNetwork.from_file(filename)
+
+    return {
+        "parse_input_s": time_call(
+            lambda: utils.parse_input(filename, cache=False), repeats
+        ),
+        "load_cold_s": time_call(cold, repeats),
+        "load_warm_s": time_call(lambda: RoadNetwork.from_file(filename), repeats),
+    }
+
+
+def bench_engine(network, engine, repeats=5):
+    # Measure reset and one full run of an engine on a fixed random schedule.
+    # Throughput is given in simulated iterations and in cars passing a light
+    # per second, and for the event engine also in events handled per second.
+    sim = ENGINES[engine].from_network(network)
+    genome = np.random.default_rng(0).integers(
+        1, 3, len(network.in_streets), endpoint=True
+    )
+
+    sim.reset()
+    sim.load_genome(genome)
+    start = time.perf_counter()
+    score = sim.full_run()
+    run_time = time.perf_counter() - start
+    counters = sim.run_counters()
+
+    result = {
+        "score": int(score),
+        "full_run_s": run_time,
+        "ticks_per_s": counters["ticks"] / run_time,
+        "car_moves_per_s": counters["cars_passed"] / run_time,
+        "reset_s": time_call(sim.reset, repeats),
+    }
+    if "events_per_s" in counters:
+        result["events_per_s"] = counters["events_per_s"]
+    return result
+
+
+def bench_generation(network, engine, gen_size=20, nr_gens=3):
+    # Measure the mean time of a generation, and the peak memory allocated while
+    # running one more generation.
+    sim = Simulation.from_network(network)
+    pop = Population(
+        sim,
+        network.intersection_dict(),
+        gen_size=gen_size,
+        candidate_size=gen_size,
+        tournament_size=2,
+        mutation_rate=0.01,
+        engine=engine,
+        seed=0,
+    )
+    start = time.perf_counter()
+    pop.run(nr_gens, verbose=False)
+    generation_time = (time.perf_counter() - start) / nr_gens
+
+    tracemalloc.start()
+    pop.run(1, verbose=False)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pop.close()
+
+    return {
+        "generation_s": generation_time,
+        "generation_peak_mb": peak / 2**20,
+        "best_fitness": int(pop.fitness.max()),
+    }
+
+
+def bench_network(network, engines, ea_engine, repeats=5):
+    # Run all simulation and EA benchmarks on one network.
+    result = {
+        "streets": len(network.street_names),
+        "intersections": len(network.int_ids),
+        "cars": len(network.path_lengths),
+        "nr_iters": network.nr_iters,
+        "engines": {
+            engine: bench_engine(network, engine, repeats) for engine in engines
+        },
+    }
+    if ea_engine is not None:
+        result["ea"] = bench_generation(network, ea_engine)
+    return result
+
+
+def grid_city(width):
+    # Generate a reproducible width by width grid city with a car per intersection.
+    random.seed(width)
+    np.random.seed(width)
+    return Grid(width, simple_scenario=True).gen_network(
+        duration=1000, num_cars=width * width, hops=12
+    )
+
+
+def random_city(nr_intersections, nr_cars=100000):
+    # Generate a reproducible complex scenario city with 2 to 6 streets into
+    # every intersection, and write it to a temporary file. Returns the network
+    # parsed from that file, the time to write it and the size of the file.
+    np.random.seed(nr_intersections)
+    filename = os.path.join(tempfile.gettempdir(), f"city_{nr_intersections}.in")
+    start = time.perf_counter()
+    Grid(nr_intersections, simple_scenario=False).gen_hashcode_file(
+        filename,
+        duration=1000,
+        num_cars=nr_cars,
+        hops=12,
+        min_neighbors=2,
+        max_neighbors=6,
+    )
+    generate_time = time.perf_counter() - start
+    size = os.path.getsize(filename)
+    network = RoadNetwork.from_file(filename, cache=False)
+    os.remove(filename)
+    return network, generate_time, size
+
+
+def environment():
+    # Describe the version and machine the results were measured on.
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_suite(
+    files, grid_sizes, engines, ea_engine="event", repeats=5, city_sizes=()
+):
+    # Benchmark every file, grid city and random city. Results are keyed by file
+    # name, by grid width and by number of intersections. Random cities are too
+    # large for the EA, so only the engines are measured on them.
+    results = {"environment": environment(), "files": {}, "grids": {}, "cities": {}}
+    for filename in files:
+        result = bench_parse(filename, repeats)
+        network = RoadNetwork.from_file(filename)
+        result.update(bench_network(network, engines, ea_engine, repeats))
+        results["files"][os.path.basename(filename)] = result
+    for width in grid_sizes:
+        start = time.perf_counter()
+        network = grid_city(width)
+        result = {"generate_s": time.perf_counter() - start}
+        result.update(bench_network(network, engines, ea_engine, repeats))
+        results["grids"][str(width)] = result
+    for nr_intersections in city_sizes:
+        network, generate_time, size = random_city(nr_intersections)
+        result = {"generate_s": generate_time, "file_mb": size / 2**20}
+        result.update(bench_network(network, engines, None, repeats))
+        results["cities"][str(nr_intersections)] = result
+    return results
+
+
+def flatten(results, prefix=""):
+    # Flatten nested results to keys such as "files/test.in/engines/event/reset_s".
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}/"))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline):
+    # Ratio of every timing, the keys ending in _s, to the same timing in a
+    # baseline. Below 1 is faster.
+    new = flatten(results)
+    old = flatten(baseline)
+    return {
+        key: new[key] / old[key]
+        for key in new
+        if key.endswith("_s") and key in old and old[key] > 0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing, simulation and the EA."
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=["./data/test.in", "./data/complex_test.in", "./data/hashcode.in"],
+        help="Input files in hashcode format to benchmark on.",
+    )
+    parser.add_argument(
+        "--grid_sizes",
+        dest="grid_sizes",
+        nargs="*",
+        default=[10, 20, 40],
+        type=int,
+        help="Widths of the Grid generated cities to benchmark on.",
+    )
+    parser.add_argument(
+        "--city_sizes",
+        dest="city_sizes",
+        nargs="*",
+        default=[],
+        type=int,
+        help="Numbers of intersections of the random cities with 100000 cars to benchmark on. 250000 intersections give about a million streets.",
+    )
+    parser.add_argument(
+        "--engines",
+        dest="engines",
+        nargs="*",
+        default=["tick", "vector", "event"],
+        help="Simulation engines to measure. The 'tick' engine takes minutes on hashcode.in.",
+    )
+    parser.add_argument(
+        "--ea_engine",
+        dest="ea_engine",
+        default="event",
+        type=str,
+        help="Simulation engine used to time generations of the EA.",
+    )
+    parser.add_argument(
+        "--repeats",
+        dest="repeats",
+        default=5,
+        type=int,
+        help="Number of timed repeats of fast measurements, the fastest of which is reported.",
+    )
+    parser.add_argument(
+        "--output",
+        dest="output",
+        default=None,
+        type=str,
+        help="File to write the JSON results to. Printed if not set.",
+    )
+    parser.add_argument(
+        "--compare",
+        dest="compare",
+        default=None,
+        type=str,
+        help="JSON results of an earlier run to compare timings with.",
+    )
+    args = parser.parse_args()
+
+    results = run_suite(
+        args.files,
+        args.grid_sizes,
+        args.engines,
+        args.ea_engine,
+        args.repeats,
+        args.city_sizes,
+    )
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            results["ratios"] = compare(results, json.load(f))
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -6,83 +6,419 @@ Created on Wed May  5 12:52:40 2021
 """
 
 from os import replace
+from multiprocessing import Pool
 from numpy.random import default_rng
 import numpy as np
-from collections import defaultdict, deque
-from tqdm import trange
+from collections import defaultdict, OrderedDict
+import hashlib
+import json
+import os
+import queue
+import time
+from tqdm import tqdm, trange
+
+from fast_simulation import EventSimulation, VectorSimulation
+from instrumentation import profiler
+from network import RoadNetwork
+from simulation_classes import Simulation
+
+# Simulation engines by name. All take the same constructor arguments, and can
+# be built on a RoadNetwork with from_network.
+ENGINES = {"tick": Simulation, "vector": VectorSimulation, "event": EventSimulation}
+
+# Simulation engine of a worker process, built once by init_worker.
+worker_engine = None
+
+
+def init_worker(network, engine):
+    # Build the simulation engine of a worker process from the compiled network.
+    global worker_engine
+    worker_engine = ENGINES[engine].from_network(network)
+
+
+def evaluate_genomes(genomes, batched=False, threshold=None):
+    # Score a list of flat genomes in a worker process. Returns a (score, pruned)
+    # pair per genome, see Population.prune_threshold.
+    if batched:
+        scores = worker_engine.run_genomes(genomes, threshold=threshold)
+        return [
+            (score, pruned)
+            for score, pruned in zip(scores, worker_engine.pruned_lanes.tolist())
+        ]
+
+    results = []
+    for genome in genomes:
+        worker_engine.reset()
+        worker_engine.load_genome(genome)
+        score = worker_engine.full_run(threshold=threshold)
+        results.append((score, worker_engine.pruned))
+    return results
+
+
+def rank_correlation(a, b):
+    # Spearman rank correlation of two sequences of scores. Tied scores share
+    # their mean rank. NaN if either sequence is constant.
+    ranks = []
+    for scores in (a, b):
+        values, inverse, counts = np.unique(
+            scores, return_inverse=True, return_counts=True
+        )
+        ranks.append((np.cumsum(counts) - (counts - 1) / 2)[inverse])
+    if ranks[0].std() == 0 or ranks[1].std() == 0:
+        return float("nan")
+    return float(np.corrcoef(ranks[0], ranks[1])[0, 1])
+
+
+# Number of timings per block of a BlockGenome.
+BLOCK_SIZE = 64
+
+
+def genome_dtype(timing_cap):
+    # Smallest unsigned integer type that holds all timings up to timing_cap.
+    return np.min_scalar_type(timing_cap)
+
+
+class BlockGenome:
+    def __init__(self, array, block_size=BLOCK_SIZE):
+        """
+        Class to hold a flat genome as a list of fixed-size blocks that copies
+        share until they are written to. A copy only copies the list of blocks;
+        a block is copied the first time a genome that does not own it writes to
+        it. Memory used per copy is proportional to the number of blocks changed.
+
+        Supports len, indexing, item assignment with integers, slices and index
+        arrays, and conversion with numpy.asarray.
+
+        Parameters
+        ----------
+        array : numpy.ndarray
+            flat array of timings. The genome takes ownership of it.
+        block_size : int, optional
+            Number of timings per block. The default is BLOCK_SIZE.
+
+        """
+        self.block_size = block_size
+        self.size = len(array)
+        self.dtype = array.dtype
+        self.blocks = [
+            array[start : start + block_size] for start in range(0, self.size, block_size)
+        ]
+        # Whether this genome may write to each block in place
+        self.owned = np.ones(len(self.blocks), dtype=bool)
+
+    @classmethod
+    def from_blocks(cls, blocks, owned, size, block_size):
+        # Build a genome on existing blocks, owning those flagged in owned.
+        genome = cls.__new__(cls)
+        genome.block_size = block_size
+        genome.size = size
+        genome.dtype = blocks[0].dtype if len(blocks) > 0 else np.dtype(np.uint8)
+        genome.blocks = blocks
+        genome.owned = owned
+        return genome
+
+    def copy(self):
+        # Share all blocks with the copy. Neither genome owns them afterwards.
+        self.owned[:] = False
+        return BlockGenome.from_blocks(
+            list(self.blocks),
+            np.zeros(len(self.blocks), dtype=bool),
+            self.size,
+            self.block_size,
+        )
+
+    def select(self, mask, other):
+        # New genome that takes other where mask is set and self elsewhere.
+        # Blocks that come from one genome entirely are shared, not copied.
+        if self.size == 0:
+            return self.copy()
+        starts = np.arange(0, self.size, self.block_size)
+        counts = np.add.reduceat(mask, starts)
+        lengths = np.minimum(self.block_size, self.size - starts)
+
+        # Blocks shared with the child are no longer owned by their source.
+        from_self = counts == 0
+        from_other = counts == lengths
+        owned = ~(from_self | from_other)
+        self.owned[from_self] = False
+        other.owned[from_other] = False
+
+        # Mixed blocks are selected all at once, and then copied out one by one
+        # so that they do not keep the whole selection alive.
+        if owned.any():
+            selected = np.where(mask, other.to_array(), self.to_array())
+        source = np.where(from_self, 0, np.where(from_other, 1, 2)).tolist()
+        size = self.block_size
+        blocks = [
+            self.blocks[b]
+            if src == 0
+            else other.blocks[b]
+            if src == 1
+            else selected[b * size : (b + 1) * size].copy()
+            for b, src in enumerate(source)
+        ]
+        return BlockGenome.from_blocks(blocks, owned, self.size, self.block_size)
+
+    def to_array(self):
+        # Flat array of all timings
+        if len(self.blocks) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(self.blocks)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.to_array()[index]
+
+    def __setitem__(self, index, values):
+        # Write values, first copying every touched block this genome does not own
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(self.size))
+        index = np.atleast_1d(np.asarray(index, dtype=np.int64))
+        values = np.broadcast_to(np.asarray(values, dtype=self.dtype), index.shape)
+
+        block_ids = index // self.block_size
+        for b in np.unique(block_ids).tolist():
+            if not self.owned[b]:
+                self.blocks[b] = self.blocks[b].copy()
+                self.owned[b] = True
+            selected = block_ids == b
+            self.blocks[b][index[selected] - b * self.block_size] = values[selected]
+
+    @property
+    def nbytes(self):
+        # Memory of the blocks this genome owns
+        return sum(block.nbytes for block, owned in zip(self.blocks, self.owned) if owned)
 
 
 class Individual:
-    def __init__(self, schedules, mutation_rate=0.001, timing_cap=10):
+    def __init__(
+        self,
+        genome,
+        offsets,
+        int_ids,
+        mutation_rate=0.001,
+        timing_cap=10,
+        min_timing=None,
+    ):
         """
         Class to hold a single unit of evolution in the EA.
-        Stores all schedules for a simulation as a dict and allows for self-mutation and deep-copying.
-        Stores its own fitness.
+        Stores all schedules for a simulation as one flat genome of timings, ordered
+        by intersection and then by schedule, and allows for self-mutation and
+        copying. Stores its own fitness. The genome is a BlockGenome, so copies
+        share timings with the original until they change them.
+
+        The timings of the i-th intersection are genome[offsets[i]:offsets[i + 1]].
+        Offsets and intersection identifiers are shared by all Individuals of a
+        Population. Use from_schedules and to_schedules to convert from and to a
+        dict of schedules.
 
         Parameters
         ----------
-        schedules : dict
-            dictionary using intersection identifiers as keys and a list of integers representing
-            timings as values.
+        genome : BlockGenome or numpy.ndarray
+            flat timings, of a small unsigned integer type.
+        offsets : numpy.ndarray
+            start of the timings of every intersection in genome, followed by the
+            length of genome.
+        int_ids : list
+            intersection identifiers, in genome order.
         mutation_rate : float, optional
             Chance for the schedule of every intersection to mutate. The default is 0.001.
         timing_cap : integer, optional
             Defines the maximum amount of iterations a certain light is allowed
             to stay green before cycling. The default is 10.
+        min_timing : numpy.ndarray, optional
+            lowest timing mutation draws for every timing in genome, shared by all
+            Individuals of a Population like offsets. When None, mutate_schedule
+            draws from 1 and mutate_ind from 0. The default is None.
 
         """
-        self.schedules = schedules
+        if not isinstance(genome, BlockGenome):
+            genome = BlockGenome(genome)
+        self.genome = genome
+        self.offsets = offsets
+        self.int_ids = int_ids
         self.mutation_rate = mutation_rate
         self.timing_cap = timing_cap
+        self.min_timing = min_timing
         self.fitness = 0
+        # Whether fitness is only an upper bound, because the simulation was
+        # aborted once the Individual could no longer survive selection.
+        self.bounded = False
+        # Individual this one was bred from, kept until it is evaluated
+        self.parent = None
+
+    @classmethod
+    def from_schedules(cls, schedules, int_ids=None, mutation_rate=0.001, timing_cap=10):
+        # Build an Individual from a dict using intersection identifiers as keys
+        # and a list of timings as values. Int_ids sets the order of the genome,
+        # by default the order of the dict.
+        if int_ids is None:
+            int_ids = list(schedules.keys())
+        lengths = [len(schedules[int_id]) for int_id in int_ids]
+        offsets = np.zeros(len(int_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        genome = np.zeros(offsets[-1], dtype=genome_dtype(timing_cap))
+        if len(int_ids) > 0:
+            genome[:] = np.concatenate([schedules[int_id] for int_id in int_ids])
+        return cls(
+            genome, offsets, int_ids, mutation_rate=mutation_rate, timing_cap=timing_cap
+        )
 
-    def mutate(self, mode="schedule"):
+    def to_schedules(self):
+        # Convert the genome to a dict using intersection identifiers as keys and
+        # a list of timings as values.
+        schedules = defaultdict(list)
+        timings = self.genome.to_array().tolist()
+        offsets = self.offsets.tolist()
+        for i, int_id in enumerate(self.int_ids):
+            schedules[int_id] = timings[offsets[i] : offsets[i + 1]]
+        return schedules
+
+    def mutate(self, mode="schedule", rng=None):
+        if rng is None:
+            rng = default_rng()
         if mode == "schedule":
-            self.mutate_schedule()
+            self.mutate_schedule(rng)
         elif mode == "individual":
-            self.mutate_ind()
-
-    def mutate_schedule(self):
-        # For each intersection check if there is a mutation
-        rng = default_rng()
-        for i, schedule in enumerate(self.schedules.values()):
-            mutation_chance = rng.random()
-            # If a mutation takes place, replace one timing in the schedule
-            # with a random number under the cap
-            if mutation_chance <= self.mutation_rate:
-                random_index = rng.integers(0, len(schedule))
-                random_timing = rng.integers(1, self.timing_cap, endpoint=True)
-                schedule[random_index] = random_timing
-                self.schedules[i] = schedule
-
-    def mutate_ind(self):
-        rng = default_rng()
+            self.mutate_ind(rng)
+
+    def mutate_schedule(self, rng):
+        # Every intersection mutates with chance mutation_rate. Draw how many
+        # do, and which, at once instead of drawing for every intersection.
+        nr_ints = len(self.offsets) - 1
+        mutated = rng.choice(
+            nr_ints, rng.binomial(nr_ints, self.mutation_rate), replace=False
+        )
+        if len(mutated) == 0:
+            return
+
+        # Replace one timing in the schedule of each mutated intersection with
+        # a random number under the cap
+        lengths = self.offsets[mutated + 1] - self.offsets[mutated]
+        random_index = self.offsets[mutated] + rng.integers(0, lengths)
+        low = 1 if self.min_timing is None else self.min_timing[random_index]
+        self.genome[random_index] = rng.integers(
+            low, self.timing_cap, len(mutated), endpoint=True
+        )
+
+    def mutate_ind(self, rng):
+        # With chance mutation_rate, replace all timings of one random
+        # intersection.
         mutation_chance = rng.random()
         if mutation_chance <= self.mutation_rate:
-            random_index = rng.integers(0, len(self.schedules))
-            self.schedules[random_index] = list(
-                (
-                    rng.integers(
-                        0,
-                        self.timing_cap,
-                        len(self.schedules[random_index]),
-                        endpoint=True,
-                    )
-                )
+            random_index = rng.integers(0, len(self.offsets) - 1)
+            start = self.offsets[random_index]
+            end = self.offsets[random_index + 1]
+            low = 0 if self.min_timing is None else self.min_timing[start:end]
+            self.genome[start:end] = rng.integers(
+                low, self.timing_cap, end - start, endpoint=True
             )
 
-    def update_fitness(self, score):
+    def update_fitness(self, score, bounded=False):
         self.fitness = score
+        self.bounded = bounded
 
     def copy(self, fitness=False):
         ind = Individual(
-            self.schedules, mutation_rate=self.mutation_rate, timing_cap=self.timing_cap
+            self.genome.copy(),
+            self.offsets,
+            self.int_ids,
+            mutation_rate=self.mutation_rate,
+            timing_cap=self.timing_cap,
+            min_timing=self.min_timing,
         )
         if fitness == True:
             ind.update_fitness(self.fitness)
         return ind
 
 
+class FitnessCache:
+    def __init__(self, max_size=10000):
+        """
+        Class to remember the fitness of genomes that were already simulated.
+        Genomes are keyed by a hash of their bytes, and the least recently used
+        entry is evicted once more than max_size genomes are stored.
+        Counts hits and misses of all lookups.
+
+        Parameters
+        ----------
+        max_size : int, optional
+            Maximum number of genomes to remember. The default is 10000.
+
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(genome):
+        # Hash the bytes of a flat genome into a short key
+        return hashlib.blake2b(genome.tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        # Return the stored fitness for key, or None if it is not stored
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, fitness):
+        # Store a fitness, evicting the least recently used entry if full
+        self.entries[key] = fitness
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CheckpointStore:
+    def __init__(self, max_bytes):
+        """
+        Class to keep the SimulationTrace of recently evaluated genomes, keyed
+        like FitnessCache. The least recently used traces are evicted once the
+        traces together take more than max_bytes of memory.
+
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum memory used by all stored traces.
+
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        # Return the stored trace for key, or None if it is not stored
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def put(self, key, trace):
+        # Store a trace, evicting the least recently used traces if full
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+        self.entries[key] = trace
+        self.nbytes += trace.nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 0:
+            self.nbytes -= self.entries.popitem(last=False)[1].nbytes
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class Population:
     def __init__(
         self,
@@ -95,6 +431,19 @@ class Population:
         tournament_size=None,
         replace_parents=False,
         mutation_mode="schedule",
+        engine="tick",
+        batch_size=None,
+        n_workers=None,
+        seed=None,
+        cache_size=None,
+        checkpoint_memory=None,
+        resume_from=None,
+        prune=False,
+        proxy_horizon=None,
+        proxy_cars=None,
+        promote_fraction=0.5,
+        calibrate_every=10,
+        init="random",
     ):
         """
         Class containing a Simulation object and a set of Individual objects
@@ -121,11 +470,104 @@ class Population:
         Tournament_size : int, optional
             Defines the size of the tournament used in tournament select. Default value is None.
             Must be set to a value to make it useable.
+        engine : str, optional
+            Simulation engine used to evaluate Individuals. Either 'tick', which uses
+            sim itself, 'vector', which uses a VectorSimulation built from sim, or
+            'event', which uses an EventSimulation built from sim. All give the same
+            scores. The default is 'tick'.
+        batch_size : int, optional
+            Number of Individuals the 'vector' engine simulates together in one pass.
+            When None, Individuals are evaluated one at a time. The default is None.
+        n_workers : int, optional
+            Number of worker processes used to evaluate Individuals in parallel. Each
+            worker builds its own simulation engine once, after which only flat genomes
+            and scores are sent between processes. When None, Individuals are evaluated
+            in this process. The default is None.
+        seed : int, optional
+            Seed for the random number generator used for initialization, crossover,
+            mutation and selection. The default is None.
+        cache_size : int, optional
+            Number of genomes whose fitness is remembered, so that duplicate genomes
+            are not simulated again. When None, every Individual is simulated.
+            The default is None.
+        checkpoint_memory : int, optional
+            Megabytes of simulation checkpoints to keep. When set, a child is evaluated
+            by continuing its parent's run from the last checkpoint before any car
+            reaches an intersection whose timings differ, instead of from iteration 0.
+            Requires the 'vector' engine without batch or parallel evaluation.
+            The default is None.
+        resume_from : str, optional
+            Path of a file written by save_checkpoint. When set, the Individuals,
+            random number generator state, generation counter and metric history
+            are loaded from it instead of generating a random initial population.
+            The default is None.
+        prune : bool, optional
+            Whether to abort the simulation of a child as soon as an upper bound
+            on its score drops below the fitness of the worst Individual, since it
+            can then never be selected. Such children get the bound as fitness and
+            are flagged as bounded. Requires parents to compete with their children
+            and cannot be combined with checkpoint_memory. The default is False.
+        proxy_horizon : float, optional
+            Fraction of the iterations of a full run that children are screened
+            on before full evaluation. Only the promote_fraction best children on
+            this cheaper proxy are evaluated in full and compete for selection.
+            Steady-state runs are not screened. The default is None.
+        proxy_cars : float, optional
+            Fraction of the cars, sampled once, that children are screened on.
+            Can be combined with proxy_horizon. The default is None.
+        promote_fraction : float, optional
+            Fraction of the screened children that is evaluated in full. The
+            default is 0.5.
+        calibrate_every : int, optional
+            Every calibrate_every generations, all screened children are evaluated
+            in full, to measure how well the proxy ranks them. When None, the
+            proxy is never calibrated. The default is 10.
+        init : str, optional
+            How the initial population is generated. Either 'random', with uniform
+            timings for every street, from 1 for streets cars wait on and from 0
+            for the others, 'unused', which also sets the timings of
+            streets no car waits on to 0, or 'demand', which gives the busiest
+            street of each intersection a random timing and every other street
+            a timing in proportion to the number of cars waiting on it. Cars that
+            cannot reach a street before the end of a run are not counted, see
+            RoadNetwork.route_statistics. The default is 'random'.
 
         """
 
         self.sim = sim
         self.intersection_dict = intersection_dict
+        # Compiled network of the simulation
+        self.network = sim.network
+        if self.network is None:
+            self.network = RoadNetwork.from_dicts(
+                sim.streets, sim.original_paths, sim.nr_iters, sim.score_per_car
+            )
+
+        # Genome layout shared by all Individuals: intersections with timings
+        # that are not fixed by the network, in simulation order, where the
+        # timings of each start, and the intersection of every timing.
+        self.int_ids = self.network.int_ids[self.network.free_ints].tolist()
+        self.offsets = self.network.free_offsets
+        self.timing_int = np.repeat(np.arange(len(self.int_ids)), np.diff(self.offsets))
+        if len(self.int_ids) == 0:
+            raise ValueError("Network has no timings to evolve, all are fixed.")
+
+        # CSR form of intersection_dict for crossover: the neighbours of node n
+        # are adj_nodes[adj_offsets[n]:adj_offsets[n + 1]]. Int_position maps a
+        # node to its index in int_ids, or -1 if it has no schedule.
+        self.nr_nodes = max(
+            [len(self.int_ids)]
+            + [n + 1 for n in self.int_ids]
+            + [n + 1 for n in intersection_dict.keys()]
+        )
+        neighbours = [intersection_dict.get(n, []) for n in range(self.nr_nodes)]
+        self.adj_offsets = np.zeros(self.nr_nodes + 1, dtype=np.int64)
+        np.cumsum([len(nodes) for nodes in neighbours], out=self.adj_offsets[1:])
+        self.adj_nodes = np.array(
+            [node for nodes in neighbours for node in nodes], dtype=np.int64
+        )
+        self.int_position = np.full(self.nr_nodes, -1, dtype=np.int64)
+        self.int_position[self.int_ids] = np.arange(len(self.int_ids))
 
         self.timing_cap = timing_cap
         self.mutation_rate = mutation_rate
@@ -134,6 +576,107 @@ class Population:
         self.tournament_size = tournament_size
         self.replace = replace_parents
         self.mut_mode = mutation_mode
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.rng = default_rng(seed)
+        self.cache = FitnessCache(cache_size) if cache_size else None
+        self.traces = None
+        self.prune = prune
+        self.run_stats = {}
+        # Number of genomes simulated, of which nr_pruned were aborted, and the
+        # wall-clock time in seconds and best fitness after every generation or
+        # steady-state evaluation.
+        self.nr_evaluations = 0
+        self.nr_pruned = 0
+        self.history = []
+        # Generations done so far, and the best, worst and mean fitness of each
+        self.generation = 0
+        self.best_run = []
+        self.worst_run = []
+        self.mean_run = []
+
+        if engine == "tick":
+            self.engine = sim
+        elif engine in ENGINES:
+            self.engine = ENGINES[engine].from_simulation(sim)
+        else:
+            raise ValueError("Engine must be either 'tick', 'vector' or 'event'.")
+
+        if batch_size is not None:
+            if engine != "vector":
+                raise ValueError("Batch evaluation requires the 'vector' engine.")
+
+            if batch_size < 1:
+                raise ValueError("Batch_size must be 1 or higher.")
+
+        if checkpoint_memory is not None:
+            if engine != "vector" or batch_size is not None or n_workers is not None:
+                raise ValueError(
+                    "Checkpoints require the 'vector' engine without batch or parallel evaluation."
+                )
+
+            self.traces = CheckpointStore(checkpoint_memory * 2**20)
+
+        if prune:
+            if replace_parents:
+                raise ValueError("Pruning requires parents to compete with their children.")
+
+            if checkpoint_memory is not None:
+                raise ValueError("Pruning cannot be combined with checkpoints.")
+
+        if n_workers is not None and n_workers < 1:
+            raise ValueError("N_workers must be 1 or higher.")
+
+        # Number of cars waiting on the street of every timing in the genome, and
+        # its share of the busiest street of its intersection.
+        if init not in ("random", "unused", "demand"):
+            raise ValueError("Init must be either 'random', 'unused' or 'demand'.")
+
+        self.init = init
+        usage = self.network.route_statistics()[0]
+        self.slot_usage = usage[self.network.in_streets[self.network.free_slots]]
+        busiest = np.zeros(len(self.int_ids), dtype=np.int64)
+        np.maximum.at(busiest, self.timing_int, self.slot_usage)
+        self.slot_share = self.slot_usage / np.maximum(busiest, 1)[self.timing_int]
+        # A timing of 0 never turns green, so streets cars wait on are drawn
+        # from 1 when initializing and mutating.
+        self.min_timing = (self.slot_usage > 0).astype(genome_dtype(self.timing_cap))
+
+        # Engine on a cheaper proxy network that children are screened on, and
+        # the rank correlation of proxy and full scores of every calibration.
+        self.proxy_engine = None
+        self.proxy_iters = None
+        self.proxy_car_ids = None
+        self.promote_fraction = promote_fraction
+        self.calibrate_every = calibrate_every
+        self.screen_history = []
+        self.screen_stats = dict(
+            proxy_evaluations=0, proxy_seconds=0.0, full_evaluations=0, full_seconds=0.0
+        )
+        if proxy_horizon is not None or proxy_cars is not None:
+            for name, fraction in (
+                ("Proxy_horizon", proxy_horizon),
+                ("Proxy_cars", proxy_cars),
+                ("Promote_fraction", promote_fraction),
+            ):
+                if fraction is not None and not 0 < fraction <= 1:
+                    raise ValueError(f"{name} must be above 0 and at most 1.")
+
+            if calibrate_every is not None and calibrate_every < 1:
+                raise ValueError("Calibrate_every must be 1 or higher.")
+
+            if proxy_horizon is not None:
+                self.proxy_iters = max(1, int(proxy_horizon * self.network.nr_iters))
+            if proxy_cars is not None:
+                nr_cars = len(self.network.path_lengths)
+                self.proxy_car_ids = np.sort(
+                    self.rng.choice(
+                        nr_cars, max(1, int(proxy_cars * nr_cars)), replace=False
+                    )
+                )
+            self.proxy_engine = ENGINES[engine].from_network(
+                self.network.proxy(self.proxy_iters, self.proxy_car_ids)
+            )
 
         if tournament_size:
             if tournament_size < 2:
@@ -144,195 +687,759 @@ class Population:
                     "Tournnament_size cannot be larger than half of gen_size."
                 )
 
-        # Initialize list to hold Individual objects
+        # Initialize list to hold Individual objects, and an array holding
+        # their fitness in the same order
         self.individuals = []
+        self.fitness = np.zeros(0, dtype=np.int64)
+
+        # A checkpoint is loaded first, as it may not fit the network.
+        if resume_from is not None:
+            self.load_checkpoint(resume_from)
+
+        # Start worker processes once all arguments are checked, each building
+        # its own simulation engine once.
+        self.pool = None
+        if n_workers is not None:
+            # The compiled network is much cheaper to send than the street dict.
+            self.pool = Pool(
+                n_workers, initializer=init_worker, initargs=(self.network, engine)
+            )
 
-        # Generate intial random pop
+        if resume_from is not None:
+            return
+
+        # Generate intial pop
         for i in range(self.gen_size):
             self.random_individual()
 
-        for individual in self.individuals:
-            self.evaluate_ind(individual)
+        self.evaluate_all(self.individuals)
+        self.fitness = np.array([ind.fitness for ind in self.individuals])
 
-    def random_individual(self):
-        # Generate a random schedule and store as Individual
-        schedules = defaultdict(list)
-        rng = default_rng()
+    def save_checkpoint(self, filename):
+        # Write everything needed to continue the run exactly as it would have
+        # gone to a .npz file. The file is written under a temporary name and
+        # then moved in place, so an interrupted write never leaves a broken
+        # checkpoint behind.
+        genomes = np.zeros((0, self.offsets[-1]), dtype=genome_dtype(self.timing_cap))
+        if len(self.individuals) > 0:
+            genomes = np.stack([self.genome(ind) for ind in self.individuals])
+        # The cars screened on were drawn when the run started, so they are kept
+        # to screen on the same proxy after resuming.
+        proxy = dict(
+            screen_history=np.array(self.screen_history, dtype=np.float64).reshape(
+                -1, 3
+            )
+        )
+        if self.proxy_car_ids is not None:
+            proxy["proxy_car_ids"] = self.proxy_car_ids
+
+        temp_file = filename + ".tmp"
+        with open(temp_file, "wb") as f:
+            np.savez(
+                f,
+                offsets=self.offsets,
+                genomes=genomes,
+                fitness=self.fitness,
+                rng_state=np.array(json.dumps(self.rng.bit_generator.state)),
+                generation=np.array(self.generation),
+                nr_evaluations=np.array(self.nr_evaluations),
+                best_run=np.array(self.best_run),
+                worst_run=np.array(self.worst_run),
+                mean_run=np.array(self.mean_run, dtype=np.float64),
+                **proxy,
+            )
+        os.replace(temp_file, filename)
+
+    def load_checkpoint(self, filename):
+        # Restore the state written by save_checkpoint.
+        with np.load(filename) as checkpoint:
+            if not np.array_equal(checkpoint["offsets"], self.offsets):
+                raise ValueError("Checkpoint was made for a different network.")
 
-        for int_id, intersection in self.sim.intersections.items():
-            schedules[int_id].extend(
-                rng.integers(
-                    0, self.timing_cap, len(intersection.schedule), endpoint=True
+            genomes = checkpoint["genomes"].astype(genome_dtype(self.timing_cap))
+            self.fitness = checkpoint["fitness"]
+            self.rng.bit_generator.state = json.loads(str(checkpoint["rng_state"]))
+            self.generation = int(checkpoint["generation"])
+            self.nr_evaluations = int(checkpoint["nr_evaluations"])
+            self.best_run = checkpoint["best_run"].tolist()
+            self.worst_run = checkpoint["worst_run"].tolist()
+            self.mean_run = checkpoint["mean_run"].tolist()
+            if "screen_history" in checkpoint:
+                self.screen_history = [
+                    (int(generation), correlation, recall)
+                    for generation, correlation, recall in checkpoint[
+                        "screen_history"
+                    ].tolist()
+                ]
+            if "proxy_car_ids" in checkpoint and self.proxy_engine is not None:
+                self.proxy_car_ids = checkpoint["proxy_car_ids"]
+                self.proxy_engine = type(self.proxy_engine).from_network(
+                    self.network.proxy(self.proxy_iters, self.proxy_car_ids)
                 )
+
+        self.individuals = []
+        for genome, fitness in zip(genomes, self.fitness):
+            individual = Individual(
+                genome,
+                self.offsets,
+                self.int_ids,
+                mutation_rate=self.mutation_rate,
+                timing_cap=self.timing_cap,
+                min_timing=self.min_timing,
             )
+            individual.update_fitness(fitness)
+            self.individuals.append(individual)
+
+    def random_individual(self):
+        # Generate a random schedule, following the init strategy, and store as
+        # Individual
+        if self.init == "demand":
+            # The busiest street of every intersection gets a random timing, and
+            # the others their share of it. Streets with cars get at least 1,
+            # unused streets get 0.
+            busiest = self.rng.integers(
+                1, self.timing_cap, len(self.int_ids), endpoint=True
+            )
+            genome = np.rint(busiest[self.timing_int] * self.slot_share)
+            genome[self.slot_usage > 0] = np.maximum(genome[self.slot_usage > 0], 1)
+            genome = genome.astype(genome_dtype(self.timing_cap))
+        else:
+            genome = self.rng.integers(
+                self.min_timing,
+                self.timing_cap,
+                self.offsets[-1],
+                endpoint=True,
+                dtype=genome_dtype(self.timing_cap),
+            )
+            if self.init == "unused":
+                genome[self.slot_usage == 0] = 0
 
         self.individuals.append(
             Individual(
-                schedules, mutation_rate=self.mutation_rate, timing_cap=self.timing_cap
+                genome,
+                self.offsets,
+                self.int_ids,
+                mutation_rate=self.mutation_rate,
+                timing_cap=self.timing_cap,
+                min_timing=self.min_timing,
             )
         )
 
     def load_ind_into_sim(self, individual):
-        # Reset Simulation object and set schedule to match Individual
-        self.sim.reset()
-        for int_id in self.sim.intersections.keys():
-            for i, street in enumerate(self.sim.intersections[int_id].schedule.keys()):
-                self.sim.intersections[int_id].set_schedule(
-                    street, individual.schedules[int_id][i]
-                )
+        # Reset simulation engine and set schedule to match Individual
+        with profiler.phase("reset"):
+            self.engine.reset()
+        with profiler.phase("load"):
+            self.engine.load_genome(self.genome(individual))
 
-    def evaluate_ind(self, individual):
+    def prune_threshold(self):
+        # Fitness a child must reach to be selected: that of the worst Individual,
+        # or None when not pruning. A child whose score bound drops below it is
+        # never selected, whether in a generation or in a steady-state insert.
+        if not self.prune or len(self.fitness) == 0:
+            return None
+        return int(self.fitness.min())
+
+    def evaluate_ind(self, individual, threshold=None):
         # Load schedule from Individual into simulation and perform a full run to
         # get a score.
         self.load_ind_into_sim(individual)
-        score = self.sim.full_run()
-        individual.update_fitness(score)
+        with profiler.phase("simulate"):
+            score = self.engine.full_run(threshold=threshold)
+        if profiler.enabled:
+            profiler.count(self.engine.run_counters())
+        self.nr_pruned += self.engine.pruned
+        individual.update_fitness(score, self.engine.pruned)
 
-    def reproduce(self, ind_1, ind_2):
-        # Use two members of current generation to generate two offspring
+    def genome(self, individual):
+        # Flat timings of an Individual, ordered by intersection and then by
+        # schedule.
+        return individual.genome.to_array()
 
-        rng = default_rng()
-        # Randomly determine crossover ratio
-        cross_ratio = rng.random() * 0.5
-        # Randomly determine seed point for spatial crossover set
-        cross_seed = rng.integers(0, len(self.sim.intersections))
+    def evaluate_all(self, individuals, prune=True):
+        # Evaluate a list of Individuals, only simulating genomes whose fitness
+        # is not in the cache. Duplicates within the list are simulated once.
+        # With prune False, no simulation is aborted by its score bound.
+        if self.cache is None:
+            self.simulate_all(individuals, prune)
+            return
 
-        # Find connected nodes to form a set for crossover
-        cross_set = self.find_connected_set(
-            cross_seed, int(cross_ratio * len(self.sim.intersections))
-        )
+        pending = OrderedDict()
+        with profiler.phase("cache"):
+            for individual in individuals:
+                key = self.cache.key(self.genome(individual))
+                if key in pending:
+                    self.cache.hits += 1
+                    pending[key].append(individual)
+                    continue
 
-        # Initialize children by copying parents.
-        child_1 = ind_1.copy()
-        child_2 = ind_2.copy()
+                fitness = self.cache.get(key)
+                if fitness is None:
+                    pending[key] = [individual]
+                else:
+                    individual.update_fitness(fitness)
 
-        # Perform crossover
-        for int_id in cross_set:  # <- this takes a lot of time
-            child_1.schedules[int_id] = ind_2.schedules[int_id]
-            child_2.schedules[int_id] = ind_1.schedules[int_id]
+        self.simulate_all([group[0] for group in pending.values()], prune)
+        for key, group in pending.items():
+            # A bound holds for this threshold only, so it is not remembered.
+            if not group[0].bounded:
+                self.cache.put(key, group[0].fitness)
+            for individual in group[1:]:
+                individual.update_fitness(group[0].fitness, group[0].bounded)
 
-        # Check for mutation
-        child_1.mutate(self.mut_mode)  # <- Also takes a lot of time
-        child_2.mutate(self.mut_mode)
+    def simulate_all(self, individuals, prune=True):
+        # Simulate a list of Individuals. With batch evaluation, batch_size of
+        # them are simulated together and their fitness is set in one go.
+        self.nr_evaluations += len(individuals)
+        threshold = self.prune_threshold() if prune else None
+        if self.pool is not None:
+            self.evaluate_parallel(individuals, threshold)
+            return
+
+        if self.traces is not None:
+            for individual in individuals:
+                self.evaluate_incremental(individual)
+            return
 
-        # Evaluate children
-        self.evaluate_ind(child_1)  # <- Also significantly decreases speed
-        self.evaluate_ind(child_2)
+        if self.batch_size is None:
+            for individual in individuals:
+                self.evaluate_ind(individual, threshold)
+            return
+
+        for start in range(0, len(individuals), self.batch_size):
+            batch = individuals[start : start + self.batch_size]
+            with profiler.phase("simulate"):
+                scores = self.engine.run_genomes(
+                    [self.genome(ind) for ind in batch], threshold=threshold
+                )
+            if profiler.enabled:
+                profiler.count(self.engine.run_counters())
+            pruned = self.engine.pruned_lanes.tolist()
+            self.nr_pruned += sum(pruned)
+            for individual, score, bounded in zip(batch, scores, pruned):
+                individual.update_fitness(score, bounded)
+
+    def evaluate_incremental(self, individual):
+        # Evaluate an Individual starting from a checkpoint of its parent's run,
+        # if that is still stored, and store the checkpoints of this run.
+        base = None
+        if individual.parent is not None:
+            base = self.traces.get(FitnessCache.key(self.genome(individual.parent)))
+            individual.parent = None
+
+        genome = self.genome(individual)
+        with profiler.phase("load"):
+            self.engine.load_genome(genome)
+        with profiler.phase("simulate"):
+            trace = self.engine.traced_run(base=base)
+        self.traces.put(FitnessCache.key(genome), trace)
+        individual.update_fitness(trace.score)
+
+    def evaluate_parallel(self, individuals, threshold=None):
+        # Split the Individuals into chunks and let the worker processes score
+        # them. Chunks hold batch_size genomes with batch evaluation, and are
+        # otherwise sized to spread the work evenly over the workers.
+        if self.batch_size is None:
+            chunk_size = max(1, -(-len(individuals) // (4 * self.n_workers)))
+        else:
+            chunk_size = self.batch_size
+        genomes = [self.genome(individual) for individual in individuals]
+        chunks = [
+            genomes[start : start + chunk_size]
+            for start in range(0, len(genomes), chunk_size)
+        ]
+
+        with profiler.phase("simulate"):
+            results = self.pool.starmap(
+                evaluate_genomes,
+                [(chunk, self.batch_size is not None, threshold) for chunk in chunks],
+            )
+        results = [result for chunk_results in results for result in chunk_results]
+        for individual, (score, bounded) in zip(individuals, results):
+            self.nr_pruned += bounded
+            individual.update_fitness(score, bounded)
+
+    def close(self):
+        # Shut down the worker processes, if any.
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def reproduce(self, ind_1, ind_2):
+        # Use two members of current generation to generate two offspring.
+        # Offspring are not evaluated yet, see evaluate_all.
+
+        with profiler.phase("crossover"):
+            # Randomly determine crossover ratio
+            cross_ratio = self.rng.random() * 0.5
+            # Randomly determine seed point for spatial crossover set, among the
+            # intersections in the genome
+            cross_seed = self.int_ids[self.rng.integers(0, len(self.int_ids))]
+
+            # Find connected nodes to form a set for crossover
+            cross_set = self.find_connected_set(
+                cross_seed, int(cross_ratio * len(self.int_ids))
+            )
+
+            # Form children with one masked select between the parent genomes.
+            # Children share the blocks of their parents that the mask leaves alone.
+            mask = self.crossover_mask(cross_set)
+            child_1 = Individual(
+                ind_1.genome.select(mask, ind_2.genome),
+                self.offsets,
+                self.int_ids,
+                mutation_rate=self.mutation_rate,
+                timing_cap=self.timing_cap,
+                min_timing=self.min_timing,
+            )
+            child_2 = Individual(
+                ind_2.genome.select(mask, ind_1.genome),
+                self.offsets,
+                self.int_ids,
+                mutation_rate=self.mutation_rate,
+                timing_cap=self.timing_cap,
+                min_timing=self.min_timing,
+            )
+            child_1.parent = ind_1
+            child_2.parent = ind_2
+
+        # Check for mutation
+        with profiler.phase("mutation"):
+            child_1.mutate(self.mut_mode, self.rng)
+            child_2.mutate(self.mut_mode, self.rng)
 
         return [child_1, child_2]
 
     def next_generation_default(self):
         nr_of_reproductions = int(self.candidate_size / 2)
 
-        # Initialize candidates for next generation by copying current generation.
+        # Every reproduction uses the first two members of the current
+        # generation, which are its two best after the first selection.
+        parent_pairs = np.zeros((nr_of_reproductions, 2), dtype=np.int64)
+        parent_pairs[:, 1] = 1
+        return self.next_generation(parent_pairs)
 
-        if self.replace:
-            candidates = []
+    def next_generation_tournament(self):
+        nr_of_reproductions = int(self.candidate_size / 2)
+        with profiler.phase("selection"):
+            parent_pairs = self.tournament_select(nr_of_reproductions)
+        return self.next_generation(parent_pairs)
+
+    def next_generation(self, parent_pairs):
+        # Generate candidates through reproduction of the given pairs of
+        # indices into the current generation, and select the next generation.
+        children = []
+        for i, j in parent_pairs.tolist():
+            children.extend(self.reproduce(self.individuals[i], self.individuals[j]))
+
+        # Evaluate all children at once, or only those that pass screening
+        if self.proxy_engine is None:
+            self.evaluate_all(children)
         else:
-            candidates = [] + self.individuals
+            children = self.evaluate_screened(children)
+        child_fitness = np.array([c.fitness for c in children])
 
-        # Generate additional candidates through reproduction
-        for i in range(nr_of_reproductions):
-            parent_1 = self.individuals[0]
-            parent_2 = self.individuals[1]
-            candidates = candidates + self.reproduce(parent_1, parent_2)
+        # Candidates for the next generation include the current generation,
+        # unless parents are replaced.
+        if self.replace:
+            candidates = children
+            fitness = child_fitness
+        else:
+            candidates = self.individuals + children
+            fitness = np.concatenate([self.fitness, child_fitness])
 
         # Pick gen_size best performing candidates as next generation
-        candidates = np.array(candidates)
-        fitness_per_candidate = np.array([c.fitness for c in candidates])
-        indices = (-fitness_per_candidate).argsort()[: self.gen_size]
-        self.individuals = list(candidates[indices])
+        with profiler.phase("selection"):
+            survivors = self.select_survivors(fitness)
+            self.individuals = [candidates[i] for i in survivors]
+            self.fitness = fitness[survivors]
 
         # Return fitness metrics of current generation
-        fitness_per_ind = np.array([i.fitness for i in self.individuals])
-        return fitness_per_ind.max(), fitness_per_ind.min(), fitness_per_ind.mean()
+        return self.fitness.max(), self.fitness.min(), self.fitness.mean()
 
-    def next_generation_tournament(self):
-        nr_of_reproductions = int(self.candidate_size / 2)
+    def proxy_scores(self, individuals):
+        # Scores of a list of Individuals on the proxy network.
+        genomes = [self.genome(individual) for individual in individuals]
+        if self.batch_size is not None:
+            scores = []
+            for start in range(0, len(genomes), self.batch_size):
+                scores.extend(
+                    self.proxy_engine.run_genomes(genomes[start : start + self.batch_size])
+                )
+            return scores
 
-        # Initialize candidates for next generation by copying current generation.
-        if self.replace:
-            candidates = []
+        scores = []
+        for genome in genomes:
+            self.proxy_engine.reset()
+            self.proxy_engine.load_genome(genome)
+            scores.append(self.proxy_engine.full_run())
+        return scores
+
+    def evaluate_screened(self, children):
+        # Score children on the proxy and evaluate the promote_fraction best of
+        # them in full, which are returned. On calibration generations, all
+        # children are evaluated in full and returned, and the rank correlation
+        # of their proxy and full scores is recorded in screen_history, with the
+        # share of the full top that the proxy would have promoted. Those full
+        # evaluations are not pruned, so proxy ranks are compared with scores
+        # rather than bounds.
+        start = time.perf_counter()
+        with profiler.phase("screen"):
+            proxy = np.array(self.proxy_scores(children))
+        self.screen_stats["proxy_evaluations"] += len(children)
+        self.screen_stats["proxy_seconds"] += time.perf_counter() - start
+
+        nr_promoted = max(1, int(np.ceil(self.promote_fraction * len(children))))
+        promoted = np.sort(np.argsort(-proxy, kind="stable")[:nr_promoted])
+        calibrate = (
+            self.calibrate_every is not None
+            and self.generation % self.calibrate_every == 0
+        )
+        if not calibrate:
+            children = [children[i] for i in promoted.tolist()]
+
+        start = time.perf_counter()
+        self.evaluate_all(children, prune=not calibrate)
+        self.screen_stats["full_evaluations"] += len(children)
+        self.screen_stats["full_seconds"] += time.perf_counter() - start
+
+        if calibrate:
+            full = np.array([child.fitness for child in children])
+            best = np.argsort(-full, kind="stable")[:nr_promoted]
+            self.screen_history.append(
+                (
+                    self.generation,
+                    rank_correlation(proxy, full),
+                    len(np.intersect1d(best, promoted)) / nr_promoted,
+                )
+            )
+        return children
+
+    def select_survivors(self, fitness):
+        # Indices of the gen_size highest fitness values, best first. Only the
+        # survivors are sorted, after a partition of all candidates.
+        nr_survivors = min(self.gen_size, len(fitness))
+        if nr_survivors < len(fitness):
+            survivors = np.argpartition(-fitness, nr_survivors - 1)[:nr_survivors]
         else:
-            candidates = [] + self.individuals
+            survivors = np.arange(len(fitness))
+        return survivors[np.argsort(-fitness[survivors], kind="stable")]
 
-        # Generate additional candidates through reproduction
-        for i in range(nr_of_reproductions):
-            parent_1, parent_2 = self.tournament_select()
-            # TODO make this method more efficient, this one slows down the algorithm most of all.
-            candidates = candidates + self.reproduce(parent_1, parent_2)
+    def emigrants(self, nr_migrants):
+        # Flat genomes and fitness of the nr_migrants best Individuals, best first.
+        nr_migrants = min(nr_migrants, len(self.individuals))
+        if nr_migrants == 0:
+            return []
+        best = np.argpartition(-self.fitness, nr_migrants - 1)[:nr_migrants]
+        best = best[np.argsort(-self.fitness[best], kind="stable")]
+        return [
+            (self.genome(self.individuals[i]), self.fitness[i]) for i in best.tolist()
+        ]
 
-        # Pick gen_size best performing candidates as next generation
-        candidates = np.array(candidates)
-        fitness_per_candidate = np.array([c.fitness for c in candidates])
-        indices = (-fitness_per_candidate).argsort()[: self.gen_size]
-        self.individuals = list(candidates[indices])
+    def immigrate(self, migrants):
+        # Take in (genome, fitness) pairs from other populations. Migrants replace
+        # the worst Individuals if they are fitter.
+        immigrants = []
+        for genome, fitness in migrants:
+            immigrant = Individual(
+                np.asarray(genome, dtype=genome_dtype(self.timing_cap)),
+                self.offsets,
+                self.int_ids,
+                mutation_rate=self.mutation_rate,
+                timing_cap=self.timing_cap,
+                min_timing=self.min_timing,
+            )
+            immigrant.update_fitness(fitness)
+            immigrants.append(immigrant)
 
-        # Return fitness metrics of current generation
-        fitness_per_ind = np.array([i.fitness for i in self.individuals])
-        return fitness_per_ind.max(), fitness_per_ind.min(), fitness_per_ind.mean()
+        candidates = self.individuals + immigrants
+        fitness = np.concatenate(
+            [self.fitness, [immigrant.fitness for immigrant in immigrants]]
+        ).astype(self.fitness.dtype)
+        survivors = self.select_survivors(fitness)[: len(self.individuals)]
+        self.individuals = [candidates[i] for i in survivors]
+        self.fitness = fitness[survivors]
 
     def find_connected_set(self, seed_point, set_size):
         # Use random seed point to generate a set of spatially close nodes
-        # through a BFS search
+        # through a BFS search. Returns an array of unique nodes in BFS order,
+        # which always holds the seed point. Only nodes in the genome count
+        # towards set_size, so a reduced genome gets the same share crossed over
+        # as the full one. The search still passes through the other nodes. If
+        # the seed point lies in a component with fewer than set_size genome
+        # nodes, the whole component is returned.
 
         # Initialize connected set by incorporating seed point
-        visited = [seed_point]
+        visited = np.zeros(self.nr_nodes, dtype=bool)
+        visited[seed_point] = True
+        found = [np.array([seed_point], dtype=np.int64)]
+        nr_found = int(self.int_position[seed_point] >= 0)
+
+        # Perform BFS one level at a time until the set has the required size
+        frontier = found[0]
+        while nr_found < set_size and len(frontier) > 0:
+            # Gather the neighbours of all frontier nodes, in order
+            starts = self.adj_offsets[frontier]
+            counts = self.adj_offsets[frontier + 1] - starts
+            first = np.cumsum(counts) - counts
+            neighbours = self.adj_nodes[
+                np.arange(counts.sum()) + np.repeat(starts - first, counts)
+            ]
 
-        # Initialize search queue by appending all connected nodes from seed point
-        to_visit = deque(self.intersection_dict[seed_point])
+            # Keep the first occurrence of every node not visited yet, up to the
+            # genome node that completes the set
+            neighbours = neighbours[~visited[neighbours]]
+            _, first_index = np.unique(neighbours, return_index=True)
+            frontier = neighbours[np.sort(first_index)]
+            in_genome = np.cumsum(self.int_position[frontier] >= 0)
+            frontier = frontier[: np.searchsorted(in_genome, set_size - nr_found) + 1]
 
-        # Perform BFS until visited set size equals the required size
-        while len(visited) < set_size:
-            next_node = to_visit.popleft()
-            to_visit.extend(self.intersection_dict[next_node])
-            visited.append(next_node)
+            visited[frontier] = True
+            found.append(frontier)
+            nr_found += int(np.count_nonzero(self.int_position[frontier] >= 0))
 
-        return visited
+        return np.concatenate(found)
 
-    def tournament_select(self):
+    def crossover_mask(self, cross_set):
+        # Boolean mask over the genome, set for all timings of the nodes in
+        # cross_set. Nodes without a schedule are skipped.
+        positions = self.int_position[cross_set]
+        int_mask = np.zeros(len(self.int_ids), dtype=bool)
+        int_mask[positions[positions >= 0]] = True
+        return np.repeat(int_mask, np.diff(self.offsets))
+
+    def tournament_select(self, nr_pairs=1):
+        # Hold two tournaments for each of nr_pairs pairs of parents, and return
+        # the indices of their winners as an array of shape (nr_pairs, 2). The
+        # 2 * tournament_size members drawn for one pair are all different.
         tournament_size = self.tournament_size
-        tournaments = np.random.choice(
-            self.individuals, size=2 * tournament_size, replace=False
-        )
-        tournament_1 = tournaments[:tournament_size]
-        tournament_2 = tournaments[tournament_size:]
-        # TODO optimize such that max tournament_size checks are done in the sorting algorithm
-        candidates = [
-            sorted(tournament_1, key=lambda c: c.fitness)[0],
-            sorted(tournament_2, key=lambda c: c.fitness)[0],
-        ]
-        return candidates
+        nr_members = 2 * tournament_size
+        members = self.rng.integers(0, len(self.individuals), (nr_pairs, nr_members))
 
-    def run(self, nr_gens, verbose=True):
+        # Draw again, without replacement, for pairs that drew a member twice.
+        # With gen_size much larger than tournament_size this is rare.
+        ordered = np.sort(members, axis=1)
+        for pair in np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1)):
+            members[pair] = self.rng.choice(
+                len(self.individuals), nr_members, replace=False
+            )
+
+        # The winner of each tournament is its fittest member
+        tournaments = members.reshape(nr_pairs, 2, tournament_size)
+        winners = self.fitness[tournaments].argmax(axis=2)
+        return tournaments[np.arange(nr_pairs)[:, np.newaxis], np.arange(2), winners]
+
+    def update_run_stats(self, start_time=None, start_evaluations=0):
+        # Collect counters describing the run so far in run_stats. With the
+        # start time and evaluation count of a run, also its throughput.
+        if self.cache is not None:
+            self.run_stats["cache_hits"] = self.cache.hits
+            self.run_stats["cache_misses"] = self.cache.misses
+            self.run_stats["cache_entries"] = len(self.cache)
+        if self.traces is not None:
+            self.run_stats["checkpoint_bytes"] = self.traces.nbytes
+        if self.prune:
+            self.run_stats["pruned"] = self.nr_pruned
+        if isinstance(self.engine, EventSimulation) and self.engine.run_time > 0:
+            self.run_stats["events_per_second"] = self.engine.events_per_second()
+        if self.proxy_engine is not None:
+            stats = self.screen_stats
+            self.run_stats["proxy_evaluations"] = stats["proxy_evaluations"]
+            if stats["proxy_evaluations"] > 0 and stats["full_evaluations"] > 0:
+                # Time of a proxy evaluation relative to a full evaluation
+                self.run_stats["proxy_cost"] = (
+                    stats["proxy_seconds"] / stats["proxy_evaluations"]
+                ) / (stats["full_seconds"] / stats["full_evaluations"])
+            if len(self.screen_history) > 0:
+                generation, correlation, recall = self.screen_history[-1]
+                self.run_stats["proxy_correlation"] = correlation
+                self.run_stats["proxy_recall"] = recall
+        if start_time is not None:
+            wall_time = time.perf_counter() - start_time
+            evaluations = self.nr_evaluations - start_evaluations
+            self.run_stats["evaluations"] = evaluations
+            self.run_stats["wall_time_s"] = wall_time
+            self.run_stats["evals_per_second"] = evaluations / wall_time
+            self.history.append((wall_time, self.fitness.max()))
+
+    def run(
+        self,
+        nr_gens,
+        verbose=True,
+        checkpoint_file=None,
+        checkpoint_every=None,
+        checkpoint_seconds=None,
+        profile=False,
+        profile_file=None,
+    ):
         # Perform a run of nr_gens subsequent generations, storing the intermediate
-        # metrics.
-        best_run = []
-        worst_run = []
-        mean_run = []
-        if verbose:
-            for i in trange(nr_gens):
-                best, worst, mean = (
-                    self.next_generation_tournament()
-                    if self.tournament_size
-                    else self.next_generation_default()
+        # metrics. Counters such as cache hits are kept in run_stats. Returns the
+        # metrics of the generations of this call; those of all generations so
+        # far are kept in best_run, worst_run and mean_run.
+        #
+        # With a checkpoint_file, a checkpoint is saved every checkpoint_every
+        # generations, after checkpoint_seconds of wall-clock time have passed
+        # since the last one, and at the end of the run.
+        #
+        # With profile, the time and calls per phase and the simulation counters
+        # of instrumentation.profiler are recorded and returned as a fourth
+        # value. With a profile_file, they are also appended to it as one line
+        # of JSON per generation.
+        was_enabled = profiler.enabled
+        profiler.enabled = was_enabled or profile or profile_file is not None
+        first_gen = len(self.best_run)
+        next_generation = (
+            self.next_generation_tournament
+            if self.tournament_size
+            else self.next_generation_default
+        )
+        start_time = time.perf_counter()
+        last_checkpoint = start_time
+        start_evaluations = self.nr_evaluations
+        self.history = []
+        generations = trange(nr_gens) if verbose else range(nr_gens)
+        for i in generations:
+            best, worst, mean = next_generation()
+
+            # if len(best_run) > 0:
+            #     if best != max(best_run):
+            #         print(f"Gen{i}: best = {best}")
+
+            self.best_run.append(best)
+            self.worst_run.append(worst)
+            self.mean_run.append(mean)
+            self.generation += 1
+
+            self.update_run_stats(start_time, start_evaluations)
+            if verbose and self.cache is not None:
+                generations.set_postfix(
+                    hits=self.cache.hits, misses=self.cache.misses
                 )
 
-                # if len(best_run) > 0:
-                #     if best != max(best_run):
-                #         print(f"Gen{i}: best = {best}")
+            if checkpoint_file is not None:
+                now = time.perf_counter()
+                if (
+                    i == nr_gens - 1
+                    or (checkpoint_every and self.generation % checkpoint_every == 0)
+                    or (checkpoint_seconds and now - last_checkpoint >= checkpoint_seconds)
+                ):
+                    self.save_checkpoint(checkpoint_file)
+                    last_checkpoint = now
+
+            if profile_file is not None:
+                with open(profile_file, "a") as f:
+                    report = dict(generation=self.generation, **profiler.report())
+                    f.write(json.dumps(report) + "\n")
 
-                best_run.append(best)
-                worst_run.append(worst)
-                mean_run.append(mean)
+        profiler.enabled = was_enabled
+        metrics = (
+            self.best_run[first_gen:],
+            self.worst_run[first_gen:],
+            self.mean_run[first_gen:],
+        )
+        if profile:
+            return metrics + (profiler.report(),)
+        return metrics
 
-            return best_run, worst_run, mean_run
+    def breed(self):
+        # Reproduce one pair of parents, chosen by tournament if tournaments are
+        # used and otherwise the two best Individuals.
+        with profiler.phase("selection"):
+            if self.tournament_size:
+                i, j = self.tournament_select(1)[0].tolist()
+            else:
+                i, j = np.argpartition(-self.fitness, 1)[:2].tolist()
+        return self.reproduce(self.individuals[i], self.individuals[j])
 
+    def insert(self, child, replacement="worst"):
+        # Put an evaluated child in the place of the worst Individual, or of the
+        # loser of a tournament, if the child is fitter.
+        if replacement == "worst":
+            loser = np.argmin(self.fitness)
         else:
-            for i in range(nr_gens):
-                best, worst, mean = self.next_generation()
-                best_run.append(best)
-                worst_run.append(worst)
-                mean_run.append(mean)
+            members = self.rng.choice(
+                len(self.individuals), self.tournament_size, replace=False
+            )
+            loser = members[np.argmin(self.fitness[members])]
+
+        if child.fitness > self.fitness[loser]:
+            self.individuals[loser] = child
+            self.fitness[loser] = child.fitness
+
+    def submit(self, child, finished):
+        # Start evaluating a child in a worker process. The child and its score
+        # and pruned flag are put on the finished queue when done, or None and
+        # the error.
+        if self.cache is not None:
+            fitness = self.cache.get(self.cache.key(self.genome(child)))
+            if fitness is not None:
+                finished.put((child, (fitness, False)))
+                return
+
+        child.parent = None
+        self.nr_evaluations += 1
+        self.pool.apply_async(
+            evaluate_genomes,
+            ([self.genome(child)], False, self.prune_threshold()),
+            callback=lambda results: finished.put((child, results[0])),
+            error_callback=lambda error: finished.put((None, error)),
+        )
+
+    def run_steady_state(self, nr_evals, replacement="worst", verbose=True):
+        # Evolve without generations. As soon as an evaluation finishes, the
+        # child is inserted into the population and a new child is bred. With
+        # worker processes, two evaluations per worker are kept in flight so no
+        # worker waits for the others. Returns the wall-clock times in seconds
+        # and the best fitness after each of the nr_evals evaluations.
+        if replacement not in ("worst", "tournament"):
+            raise ValueError("Replacement must be either 'worst' or 'tournament'.")
 
-            return best_run, worst_run, mean_run
+        if replacement == "tournament" and not self.tournament_size:
+            raise ValueError("Tournament replacement requires a tournament_size.")
+
+        finished = queue.Queue()
+        max_in_flight = 1 if self.pool is None else 2 * self.n_workers
+        in_flight = 0
+        children = []
+
+        start_time = time.perf_counter()
+        start_evaluations = self.nr_evaluations
+        self.history = []
+        progress = tqdm(total=nr_evals) if verbose else None
+        for i in range(nr_evals):
+            # Keep the workers busy, without starting more than nr_evals children
+            while in_flight < max_in_flight and i + in_flight < nr_evals:
+                if len(children) == 0:
+                    children = self.breed()
+                child = children.pop()
+                if self.pool is None:
+                    self.evaluate_all([child])
+                    finished.put((child, (child.fitness, child.bounded)))
+                else:
+                    self.submit(child, finished)
+                in_flight += 1
+
+            child, result = finished.get()
+            in_flight -= 1
+            if child is None:
+                raise result
+            fitness, bounded = result
+            if self.pool is not None:
+                self.nr_pruned += bounded
+                if self.cache is not None and not bounded:
+                    self.cache.put(self.cache.key(self.genome(child)), fitness)
+            child.update_fitness(fitness, bounded)
+            with profiler.phase("selection"):
+                self.insert(child, replacement)
+
+            self.update_run_stats(start_time, start_evaluations)
+            if verbose:
+                progress.update()
+                progress.set_postfix(best=self.fitness.max())
+
+        if verbose:
+            progress.close()
+        times = [t for t, best in self.history]
+        best = [best for t, best in self.history]
+        return times, best
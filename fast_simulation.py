@@ -0,0 +1,634 @@
+# -*- coding: utf-8 -*-
+"""
+Array based simulation engines that produce the same scores as Simulation.
+"""
+
+import heapq
+import time
+
+import numpy as np
+from tqdm import trange
+
+from network import RoadNetwork
+from simulation_classes import BOUND_CHECKS
+
+# Event types for EventSimulation. Arrivals sort before passes at equal times.
+ARRIVE = 0
+PASS = 1
+
+
+class ArraySimulation:
+    def __init__(self, streets, paths, score_per_car, nr_iters):
+        """
+        Base class for simulation engines that store the road network in flat
+        NumPy arrays instead of Intersection objects. Subclasses implement
+        reset and full_run, and must produce the same score as Simulation for the
+        same schedule.
+
+        Intersections and their incoming streets are ordered exactly as in
+        Simulation, so a schedule dict from an Individual can be loaded as is.
+        Engines can also be built on a compiled RoadNetwork with from_network.
+
+        Parameters
+        ----------
+        streets : dict
+            dictionary of streets using their identifiers as keys and a tuple
+            containing the intersection identifier where they end, and their length.
+        paths : list
+            list of lists, containing all the paths all the cars should take.
+        score_per_car : int
+            integer setting the score gained per car that completes its route.
+        nr_iters : int
+            integer setting the number of iterations for a single simulation.
+
+        """
+        self.build(RoadNetwork.from_dicts(streets, paths, nr_iters, score_per_car))
+
+    @classmethod
+    def from_network(cls, network):
+        # Build an engine directly on a compiled RoadNetwork.
+        engine = cls.__new__(cls)
+        engine.build(network)
+        return engine
+
+    @classmethod
+    def from_simulation(cls, sim):
+        # Build a vectorized copy of an existing Simulation object.
+        if sim.network is not None:
+            return cls.from_network(sim.network)
+        return cls(sim.streets, sim.original_paths, sim.score_per_car, sim.nr_iters)
+
+    def build(self, network):
+        # Take over the arrays of a compiled network. Subclasses extend this to
+        # set up their own state.
+        self.network = network
+        self.score_per_car = network.score_per_car
+        self.nr_iters = network.nr_iters
+
+        self.street_index = network.street_index
+        self.int_ids = network.int_ids.tolist()
+        self.street_int = network.street_int
+        # Simulation.pass_green sets distance_to_next from the first entry of the
+        # street tuple, so use the same value to match its scores.
+        self.travel_time = network.street_end
+
+        # Slot k of intersection i is the k-th street in its schedule.
+        self.in_offsets = network.in_offsets
+        self.in_degree = network.in_degree
+        self.in_streets = network.in_streets
+        self.slot_int = network.slot_int
+
+        self.path_offsets = network.path_offsets
+        self.path_lengths = network.path_lengths
+        self.path_streets = network.path_streets
+        self.route_remaining = network.route_remaining
+
+        # Every light starts with a timing of 1, as in Intersection.add_incoming.
+        self.durations = np.ones(len(self.in_streets), dtype=np.int64)
+        self.compile_schedules()
+
+    def load_schedules(self, schedules):
+        # Set all timings from a dict using intersection identifiers as keys
+        # and a list of timings, in schedule order, as values. Fixed timings of
+        # the network are kept.
+        self.load_genome(
+            np.concatenate([schedules[int_id] for int_id in self.int_ids])[
+                self.network.free_slots
+            ]
+        )
+
+    def load_genome(self, genome):
+        # Set all timings from one flat sequence, ordered by intersection and
+        # then by schedule, holding the free timings of the network.
+        self.durations = self.network.expand_genome(genome)
+        self.compile_schedules()
+
+    def compile_schedules(self):
+        # Compile the timings of all intersections at once, following the same
+        # rules as CompiledSchedule. Works on a single schedule as well as on
+        # a batch of schedules stacked along the first axis. Streets with timing
+        # 0 take up no time in the cycle and never turn green.
+        durations = self.durations
+        ends = np.cumsum(durations, axis=-1)
+        starts = ends - durations
+        first = self.in_offsets[:-1]
+
+        # Indexing the last axis of a batch gives Fortran ordered arrays, so copy
+        # to C order to keep ravel cheap. Intersections that are always red get
+        # a cycle of 1, to keep the modulo defined.
+        self.cycle_length = np.ascontiguousarray(
+            np.maximum(ends[..., self.in_offsets[1:] - 1] - starts[..., first], 1)
+        )
+        self.green_offset = np.ascontiguousarray(
+            starts - starts[..., first][..., self.slot_int]
+        )
+        self.green_duration = durations
+
+
+class SimulationTrace:
+    def __init__(self, checkpoints, first_touch, genome, score):
+        """
+        Class to hold what is needed to re-evaluate a similar schedule without
+        starting from iteration 0. Stores the checkpoints of a run, the first
+        iteration a car joined a queue at each intersection, the flat genome
+        that was simulated and its score.
+
+        Parameters
+        ----------
+        checkpoints : list
+            states returned by VectorSimulation.get_state, in order of iteration.
+        first_touch : numpy.ndarray
+            first iteration a car joins a queue at each intersection, nr_iters if never.
+        genome : numpy.ndarray
+            flat timings that were simulated.
+        score : int
+            score of the run.
+
+        """
+        self.checkpoints = checkpoints
+        self.first_touch = first_touch
+        self.genome = genome
+        self.score = score
+
+    @property
+    def nbytes(self):
+        # Memory used by the arrays of the trace
+        arrays = [self.first_touch, self.genome]
+        for checkpoint in self.checkpoints:
+            arrays.extend(checkpoint[1:])
+        return sum(array.nbytes for array in arrays)
+
+
+class VectorSimulation(ArraySimulation):
+    def __init__(self, streets, paths, score_per_car, nr_iters):
+        """
+        Class used to run simulations on flat NumPy arrays. All cars and lights
+        are advanced in batch, and the score of a full run equals the score
+        Simulation produces for the same schedule.
+
+        Since schedules are periodic, the iteration in which a car will pass its
+        light is known as soon as it joins the queue: the first green iteration
+        after the car in front of it has passed. Each queue therefore only keeps
+        the iteration in which its last car passes, and iterations in which no car
+        joins a queue or passes a light are skipped.
+
+        Several schedules can be simulated together with load_batch or run_batch.
+        All state arrays then get a leading population axis, so the cost of each
+        iteration is shared by the whole batch.
+
+        Takes the same parameters as Simulation.
+
+        """
+        super().__init__(streets, paths, score_per_car, nr_iters)
+
+    def build(self, network):
+        super().build(network)
+
+        # Give every street that cars wait on a queue. A car never waits at the
+        # end of its last street.
+        waits = np.ones(len(self.path_streets), dtype=bool)
+        waits[self.path_offsets[1:] - 1] = False
+        queued = np.unique(self.path_streets[waits])
+        self.queue_id = np.full(len(self.street_int), -1, dtype=np.int64)
+        self.queue_id[queued] = np.arange(len(queued))
+        self.nr_queues = len(queued)
+
+        self.street_slot = np.full(len(self.street_int), -1, dtype=np.int64)
+        self.street_slot[self.in_streets] = np.arange(len(self.in_streets))
+
+        self.durations = self.durations[np.newaxis, :]
+        self.compile_schedules()
+        # First iteration a car joins a queue at each intersection, only kept
+        # during traced_run.
+        self.first_touch = None
+        self.reset()
+
+    @property
+    def score(self):
+        # Score of the first, or only, schedule in the batch
+        return int(self.scores[0])
+
+    @property
+    def pruned(self):
+        # Whether the run of the first, or only, schedule was aborted
+        return bool(self.pruned_lanes[0])
+
+    def load_genome(self, genome):
+        self.load_genomes([genome])
+
+    def load_batch(self, batch):
+        # Set the timings of several schedule dicts at once, one per batch entry.
+        self.load_genomes(
+            [
+                np.concatenate([schedules[int_id] for int_id in self.int_ids])[
+                    self.network.free_slots
+                ]
+                for schedules in batch
+            ]
+        )
+
+    def load_genomes(self, genomes):
+        # Set the timings of several flat genomes at once, one per batch entry.
+        self.durations = self.network.expand_genome(
+            np.array(genomes, dtype=np.int64).reshape(
+                len(genomes), len(self.network.free_slots)
+            )
+        )
+        self.compile_schedules()
+        # The state arrays hold every batch entry, so they are rebuilt when the
+        # number of entries changes.
+        if len(self.durations) != len(self.scores):
+            self.reset()
+
+    def next_green(self, lanes, streets, t):
+        # First iteration from t onwards in which each street is green, given
+        # the batch entry each street belongs to.
+        ints = lanes * len(self.in_degree) + self.street_int[streets]
+        slots = lanes * len(self.in_streets) + self.street_slot[streets]
+        cycle = self.cycle_length.ravel()[ints]
+        position = t % cycle
+        start = self.green_offset.ravel()[slots]
+        duration = self.green_duration.ravel()[slots]
+        green = (position >= start) & (position < start + duration)
+        wait = np.where(green, t, t + (start - position) % cycle)
+        # Streets with timing 0 never turn green.
+        return np.where(duration > 0, wait, self.nr_iters)
+
+    def join_queues(self, cars, t):
+        # Line up cars, given as indices into the batch, that can pass their
+        # light from iteration t onwards, and find when each of them passes.
+        # Cars joining the same queue in one iteration line up in order of car id.
+        lanes = cars // len(self.path_lengths)
+        streets = self.street[cars]
+        queues = lanes * self.nr_queues + self.queue_id[streets]
+        order = np.argsort(queues, kind="stable")
+        cars = cars[order]
+        lanes = lanes[order]
+        streets = streets[order]
+        queues = queues[order]
+        index = np.arange(len(cars))
+        rank = index - np.maximum.accumulate(
+            np.where(np.r_[True, queues[1:] != queues[:-1]], index, 0)
+        )
+
+        # Each rank holds at most one car per queue, so it can be handled at once.
+        for r in range(rank.max() + 1):
+            ranked = rank == r
+            depart = self.next_green(
+                lanes[ranked],
+                streets[ranked],
+                np.maximum(t, self.last_pass[queues[ranked]] + 1),
+            )
+            self.last_pass[queues[ranked]] = depart
+            self.depart[cars[ranked]] = np.minimum(depart, self.nr_iters)
+        self.ready[cars] = self.nr_iters
+
+        if self.first_touch is not None:
+            ints = self.street_int[streets]
+            self.first_touch[ints] = np.minimum(self.first_touch[ints], t)
+
+    def iterate(self):
+        t = self.current_iter
+
+        # Cars that reached the end of their street in the previous iteration
+        # join the queue.
+        joining = np.flatnonzero(self.ready == t)
+        if len(joining) > 0:
+            self.join_queues(joining, t)
+
+        # Let through the cars whose light is green and who are at the front.
+        passed = np.flatnonzero(self.depart == t)
+        if len(passed) > 0:
+            self.depart[passed] = self.nr_iters
+            self.step[passed] += 1
+            car_ids = passed % len(self.path_lengths)
+
+            # Cars that turned onto their last street are done.
+            finished = self.step[passed] == self.path_lengths[car_ids] - 1
+            self.scores += (self.score_per_car + self.nr_iters - t) * np.bincount(
+                passed[finished] // len(self.path_lengths), minlength=len(self.scores)
+            )
+
+            # Other cars drive onto their next street. Cars with a travel time of
+            # 0 never reach the next light.
+            driving = passed[~finished]
+            self.street[driving] = self.path_streets[
+                self.path_offsets[car_ids[~finished]] + self.step[driving]
+            ]
+            travel = self.travel_time[self.street[driving]]
+            self.ready[driving] = np.where(
+                travel > 0, np.minimum(t + travel, self.nr_iters), self.nr_iters
+            )
+
+        # Skip ahead to the next iteration in which something happens.
+        self.current_iter = max(t + 1, min(self.ready.min(), self.depart.min()))
+
+    def full_run(self, verbose=False, threshold=None):
+        # Do a full run of the simulation. The run stops early once no car that
+        # is left can still finish. With a threshold, it is also aborted once the
+        # upper bound on the score of every batch entry drops below it. Scores
+        # then hold the bounds instead, and pruned_lanes is set.
+        interval = max(1, -(-self.nr_iters // BOUND_CHECKS))
+        next_check = self.current_iter
+        progress = trange(0, self.nr_iters) if verbose == True else None
+        while self.current_iter < self.nr_iters:
+            t = self.current_iter
+            if t >= next_check:
+                next_check = t + interval
+                bounds = self.score_bounds()
+                if np.array_equal(bounds, self.scores):
+                    break
+                if threshold is not None and np.all(bounds < threshold):
+                    self.scores = bounds
+                    self.pruned_lanes[:] = True
+                    break
+            self.iterate()
+            if progress is not None:
+                progress.update(min(self.current_iter, self.nr_iters) - t)
+        if progress is not None:
+            progress.close()
+        return self.score
+
+    def score_bounds(self):
+        # Upper bound on the final score of every batch entry: the current
+        # score, plus what every car left would score if all lights it still
+        # meets were green when it got there. Finished cars and cars that never
+        # reach their light again have neither a ready nor a depart iteration.
+        n_cars = len(self.path_lengths)
+        car_ids = np.arange(len(self.step)) % n_cars
+        remaining = self.route_remaining[self.path_offsets[car_ids] + self.step]
+        finish = np.minimum(self.ready, self.depart) + remaining
+        gain = np.where(
+            (remaining >= 0) & (finish < self.nr_iters),
+            self.score_per_car + self.nr_iters - finish,
+            0,
+        )
+        return self.scores + gain.reshape(len(self.scores), n_cars).sum(axis=1)
+
+    def run_batch(self, batch):
+        # Simulate several schedule dicts together and return the score of each.
+        self.load_batch(batch)
+        self.reset()
+        self.full_run()
+        return self.scores.tolist()
+
+    def run_genomes(self, genomes, threshold=None):
+        # Simulate several flat genomes together and return the score of each.
+        # With a threshold, see full_run, the scores may be bounds instead.
+        self.load_genomes(genomes)
+        self.reset()
+        self.full_run(threshold=threshold)
+        return self.scores.tolist()
+
+    def run_counters(self):
+        # Iterations simulated, streets passed by all cars together and number
+        # of cars that finished, since the last reset, summed over the batch.
+        finished = self.step == np.tile(self.path_lengths - 1, len(self.scores))
+        return {
+            "ticks": int(self.current_iter) * len(self.scores),
+            "cars_passed": int(self.step.sum()),
+            "cars_finished": int(finished.sum()),
+        }
+
+    def get_state(self):
+        # Copy of everything that changes during a run
+        return (
+            self.current_iter,
+            self.step.copy(),
+            self.street.copy(),
+            self.ready.copy(),
+            self.depart.copy(),
+            self.last_pass.copy(),
+            self.scores.copy(),
+        )
+
+    def set_state(self, state):
+        # Continue from a state returned by get_state. The arrays are copied, so
+        # the same state can be restored more than once.
+        self.current_iter = state[0]
+        self.step, self.street, self.ready, self.depart, self.last_pass, self.scores = (
+            array.copy() for array in state[1:]
+        )
+
+    def traced_run(self, max_checkpoints=16, base=None):
+        # Do a full run of the single loaded schedule, recording a checkpoint of
+        # the state every nr_iters / max_checkpoints iterations. Returns a
+        # SimulationTrace.
+        #
+        # If base is the trace of a run with a different schedule, the run
+        # continues from the latest checkpoint of base before any car joined a
+        # queue at an intersection whose timings differ. Up to that iteration
+        # both runs are identical, since lights only matter to waiting cars.
+        interval = max(1, -(-self.nr_iters // max_checkpoints))
+        genome = self.durations[0].copy()
+        self.first_touch = np.full(len(self.in_degree), self.nr_iters, dtype=np.int64)
+        checkpoints = []
+
+        if base is not None:
+            changed = np.unique(self.slot_int[genome != base.genome])
+            start = base.first_touch[changed].min() if len(changed) > 0 else self.nr_iters
+            if start >= self.nr_iters:
+                # No car ever waits at a changed light, so the runs are equal.
+                self.first_touch = None
+                return SimulationTrace(base.checkpoints, base.first_touch, genome, base.score)
+
+            checkpoints = [c for c in base.checkpoints if c[0] <= start]
+            self.set_state(checkpoints[-1])
+            self.first_touch = np.where(
+                base.first_touch < self.current_iter, base.first_touch, self.nr_iters
+            )
+        else:
+            self.reset()
+
+        while self.current_iter < self.nr_iters:
+            if len(checkpoints) == 0 or self.current_iter >= checkpoints[-1][0] + interval:
+                checkpoints.append(self.get_state())
+            self.iterate()
+
+        trace = SimulationTrace(checkpoints, self.first_touch, genome, self.score)
+        self.first_touch = None
+        return trace
+
+    def reset(self):
+        # Reset the simulation to its initial state, keeping the current schedules.
+        # Iterations are stored as int64 and nr_iters marks events that never happen.
+        lanes = len(self.durations)
+        n_cars = len(self.path_lengths)
+        self.step = np.zeros(lanes * n_cars, dtype=np.int64)
+        self.street = np.tile(self.path_streets[self.path_offsets[:-1]], lanes)
+        # Cars start waiting at the end of their first street.
+        self.ready = np.zeros(lanes * n_cars, dtype=np.int64)
+        self.depart = np.full(lanes * n_cars, self.nr_iters, dtype=np.int64)
+        self.last_pass = np.full(lanes * self.nr_queues, -1, dtype=np.int64)
+        self.scores = np.zeros(lanes, dtype=np.int64)
+        # Whether the run of each batch entry was aborted by its score bound
+        self.pruned_lanes = np.zeros(lanes, dtype=bool)
+        self.current_iter = 0
+
+
+class EventSimulation(ArraySimulation):
+    def __init__(self, streets, paths, score_per_car, nr_iters):
+        """
+        Class used to run discrete-event simulations. Instead of visiting every
+        intersection and car each iteration, it keeps a priority queue of cars
+        arriving at a light and cars passing a light, keyed by iteration. The cost
+        of a full run grows with the number of car moves instead of with
+        intersections times iterations. Scores equal those of Simulation.
+
+        Takes the same parameters as Simulation.
+
+        """
+        super().__init__(streets, paths, score_per_car, nr_iters)
+
+    def build(self, network):
+        super().build(network)
+
+        # Plain Python lists are faster than NumPy arrays for the scalar
+        # lookups done while handling single events.
+        self.paths = [
+            self.path_streets[start:end].tolist()
+            for start, end in zip(self.path_offsets[:-1], self.path_offsets[1:])
+        ]
+        self.street_slot = np.full(len(self.street_int), -1, dtype=np.int64)
+        self.street_slot[self.in_streets] = np.arange(len(self.in_streets))
+        self.street_slot = self.street_slot.tolist()
+        self.street_travel = self.travel_time.tolist()
+        self.route_start = self.path_offsets[:-1].tolist()
+        self.route_remaining = self.route_remaining.tolist()
+
+        self.reset_counters()
+        self.reset()
+
+    def compile_schedules(self):
+        super().compile_schedules()
+        self.slot_start = self.green_offset.tolist()
+        self.slot_duration = self.green_duration.tolist()
+        self.slot_cycle = self.cycle_length[self.slot_int].tolist()
+
+    def next_green(self, slot, t):
+        # First iteration from t onwards in which the light of slot is green, or
+        # nr_iters if it never turns green.
+        duration = self.slot_duration[slot]
+        if duration == 0:
+            return self.nr_iters
+        cycle = self.slot_cycle[slot]
+        position = t % cycle
+        start = self.slot_start[slot]
+        if start <= position < start + duration:
+            return t
+        return t + (start - position) % cycle
+
+    def full_run(self, verbose=False, threshold=None):
+        # Do a full run of the simulation by handling events in order of time.
+        # Cars that arrive at the same light in the same iteration queue up in
+        # order of car id, like in Simulation. The run stops early once no car
+        # that is left can still finish. With a threshold, it is also aborted
+        # once the upper bound on its score drops below the threshold. The bound
+        # is then returned instead of the score, and pruned is set.
+        start_time = time.perf_counter()
+        nr_iters = self.nr_iters
+        paths = self.paths
+        step = self.step
+        last_pass = self.last_pass
+        events = self.events
+        processed = 0
+        interval = max(1, -(-nr_iters // BOUND_CHECKS))
+        next_check = 0
+        end_iter = nr_iters
+
+        while events:
+            if events[0][0] >= next_check:
+                next_check = events[0][0] + interval
+                bound = self.score_bound()
+                if bound == self.score:
+                    end_iter = events[0][0]
+                    break
+                if threshold is not None and bound < threshold:
+                    self.score = bound
+                    self.pruned = True
+                    end_iter = events[0][0]
+                    break
+
+            t, kind, car_id = heapq.heappop(events)
+            processed += 1
+            path = paths[car_id]
+
+            if kind == ARRIVE:
+                # Wait for a green light and for the cars ahead in the queue.
+                street = path[step[car_id]]
+                t = self.next_green(
+                    self.street_slot[street], max(t, last_pass[street] + 1)
+                )
+                if t < nr_iters:
+                    last_pass[street] = t
+                    heapq.heappush(events, (t, PASS, car_id))
+            else:
+                step[car_id] += 1
+                if step[car_id] == len(path) - 1:
+                    # Car has reached its last street, so it is finished.
+                    self.score += self.score_per_car + nr_iters - t
+                else:
+                    # Cars with a travel time of 0 never reach the next light.
+                    travel = self.street_travel[path[step[car_id]]]
+                    if travel > 0 and t + travel < nr_iters:
+                        heapq.heappush(events, (t + travel, ARRIVE, car_id))
+
+        self.current_iter = end_iter
+        self.run_events += processed
+        self.events_processed += processed
+        self.run_time += time.perf_counter() - start_time
+        if verbose == True:
+            print(
+                f"Processed {self.events_processed} events at "
+                f"{self.events_per_second():.0f} events/s"
+            )
+        return self.score
+
+    def score_bound(self):
+        # Upper bound on the final score: the current score, plus what every car
+        # left would score if all lights it still meets were green when it got
+        # there. Every car that can still finish has exactly one pending event.
+        bound = self.score
+        for t, kind, car_id in self.events:
+            remaining = self.route_remaining[self.route_start[car_id] + self.step[car_id]]
+            finish = t + remaining
+            if remaining >= 0 and finish < self.nr_iters:
+                bound += self.score_per_car + self.nr_iters - finish
+        return bound
+
+    def run_counters(self):
+        # Iterations simulated, streets passed by all cars together, number of
+        # cars that finished and events handled, since the last reset. Also the
+        # event throughput over all runs since the last reset_counters.
+        return {
+            "ticks": self.current_iter,
+            "cars_passed": sum(self.step),
+            "cars_finished": sum(
+                step == len(path) - 1 for step, path in zip(self.step, self.paths)
+            ),
+            "events": self.run_events,
+            "events_per_s": self.events_per_second(),
+        }
+
+    def events_per_second(self):
+        # Throughput over all runs since the last reset_counters.
+        if self.run_time == 0:
+            return 0.0
+        return self.events_processed / self.run_time
+
+    def reset_counters(self):
+        # Clear the events handled and the time spent over all runs.
+        self.events_processed = 0
+        self.run_time = 0.0
+
+    def reset(self):
+        # Reset the simulation to its initial state, keeping the current schedule.
+        # Every car starts waiting at the end of its first street.
+        self.events = [(0, ARRIVE, car_id) for car_id in range(len(self.paths))]
+        self.step = [0] * len(self.paths)
+        self.last_pass = [-1] * len(self.street_int)
+        self.run_events = 0
+        self.score = 0
+        self.current_iter = 0
+        # Whether the last run was aborted by its score bound
+        self.pruned = False
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Low-overhead timing of the phases of an EA run, and simulation counters.
+"""
+
+from collections import defaultdict
+from contextlib import nullcontext
+import time
+
+# Context returned for every phase while timing is disabled
+NULL_PHASE = nullcontext()
+
+
+class Phase:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.seconds[self.name] += time.perf_counter() - self.start
+        self.instrumentation.calls[self.name] += 1
+        return False
+
+
+class Instrumentation:
+    def __init__(self, enabled=False):
+        """
+        Class to accumulate the time spent in and the number of calls of named
+        phases, such as parse, reset or crossover, and to sum counters such as
+        the number of cars that finished. Phases are timed with
+
+            with profiler.phase("crossover"):
+                ...
+
+        While disabled, phase returns one shared no-op context and count does
+        nothing, so instrumented code runs at practically full speed.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether to record anything. The default is False.
+
+        """
+        self.enabled = enabled
+        self.reset()
+
+    def phase(self, name):
+        # Context manager timing one call of the named phase
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def count(self, counters):
+        # Add a dict of counter values to the totals. Rates, named with a _per_s
+        # suffix, already cover all runs, so only their latest value is kept.
+        if self.enabled:
+            for name, value in counters.items():
+                if name.endswith("_per_s"):
+                    self.counters[name] = value
+                else:
+                    self.counters[name] += value
+
+    def report(self):
+        # Accumulated times, calls and counters as a JSON serializable dict
+        return {
+            "phases": {
+                name: {"seconds": self.seconds[name], "calls": self.calls[name]}
+                for name in self.seconds
+            },
+            "counters": {name: int(value) for name, value in self.counters.items()},
+        }
+
+    def reset(self):
+        # Forget everything recorded so far
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+
+# Instrumentation shared by all modules of this process.
+profiler = Instrumentation()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Island model: several Populations evolving in their own processes, exchanging
+their best Individuals every few generations.
+"""
+
+from multiprocessing import Pipe, Process
+import time
+
+import numpy as np
+
+from evo_classes import Population
+from simulation_classes import Simulation
+
+TOPOLOGIES = ("ring", "full")
+
+
+def migration_targets(topology, nr_islands):
+    # Islands every island sends its emigrants to. In a ring, island i sends to
+    # island i + 1. Fully connected, every island sends to all others.
+    if topology == "ring":
+        if nr_islands == 1:
+            return [[]]
+        return [[(i + 1) % nr_islands] for i in range(nr_islands)]
+    return [[j for j in range(nr_islands) if j != i] for i in range(nr_islands)]
+
+
+def run_island(conn, network, params):
+    # Body of an island process. Builds a Population on the network and evolves
+    # it on commands received from the IslandModel over conn.
+    sim = Simulation.from_network(network)
+    pop = Population(sim, network.intersection_dict(), **params)
+    try:
+        while True:
+            command, argument = conn.recv()
+            if command == "evolve":
+                nr_gens, nr_migrants = argument
+                best, worst, mean = pop.run(nr_gens, verbose=False)
+                conn.send((best, pop.emigrants(nr_migrants)))
+            elif command == "immigrate":
+                pop.immigrate(argument)
+            elif command == "best":
+                conn.send(pop.emigrants(1)[0])
+            elif command == "stop":
+                return
+    finally:
+        pop.close()
+        conn.close()
+
+
+class IslandModel:
+    def __init__(
+        self,
+        network,
+        island_params,
+        migration_interval=10,
+        nr_migrants=1,
+        topology="ring",
+        seed=None,
+    ):
+        """
+        Class to run an island model EA. Every island is a Population in its own
+        process, with its own parameters and its own stream of the random number
+        generator. Every migration_interval generations, each island sends its
+        nr_migrants best Individuals to its neighbours in the topology, where they
+        replace the worst Individuals if they are fitter. Islands communicate with
+        the runner over pipes, so all islands run on one machine.
+
+        Parameters
+        ----------
+        network : RoadNetwork
+            compiled road network every island simulates.
+        island_params : list
+            list of dicts of keyword arguments for the Population of every island,
+            such as mutation_rate, tournament_size or replace_parents. The number
+            of islands is the length of the list. A seed given here is overruled.
+        migration_interval : int, optional
+            Number of generations between migrations. The default is 10.
+        nr_migrants : int, optional
+            Number of Individuals each island sends to each neighbour. The default is 1.
+        topology : str, optional
+            Either 'ring', where island i sends to island i + 1, or 'full', where
+            every island sends to all others. The default is 'ring'.
+        seed : int, optional
+            Seed from which the random number streams of all islands are spawned.
+            The default is None.
+
+        """
+        if len(island_params) < 1:
+            raise ValueError("At least one island is needed.")
+
+        if migration_interval < 1:
+            raise ValueError("Migration_interval must be 1 or higher.")
+
+        if nr_migrants < 0:
+            raise ValueError("Nr_migrants cannot be negative.")
+
+        if topology not in TOPOLOGIES:
+            raise ValueError("Topology must be either 'ring' or 'full'.")
+
+        self.network = network
+        self.nr_islands = len(island_params)
+        self.migration_interval = migration_interval
+        self.nr_migrants = nr_migrants
+        self.targets = migration_targets(topology, self.nr_islands)
+
+        # Best fitness of every island after every generation, the global best
+        # after every generation, and (wall-clock time, island bests) after
+        # every migration interval.
+        self.island_best = [[] for i in range(self.nr_islands)]
+        self.global_best = []
+        self.history = []
+
+        # Start one process per island, each seeded with its own stream.
+        streams = np.random.SeedSequence(seed).spawn(self.nr_islands)
+        self.connections = []
+        self.processes = []
+        for params, stream in zip(island_params, streams):
+            conn, island_conn = Pipe()
+            process = Process(
+                target=run_island,
+                args=(island_conn, network, dict(params, seed=stream)),
+            )
+            process.start()
+            island_conn.close()
+            self.connections.append(conn)
+            self.processes.append(process)
+
+    def run(self, nr_gens):
+        # Evolve all islands for nr_gens generations, migrating every
+        # migration_interval generations. Returns the best fitness per island
+        # and the global best, both per generation.
+        start_time = time.perf_counter()
+        done = 0
+        while done < nr_gens:
+            nr_epoch_gens = min(self.migration_interval, nr_gens - done)
+
+            # Let all islands evolve at the same time
+            for conn in self.connections:
+                conn.send(("evolve", (nr_epoch_gens, self.nr_migrants)))
+            results = [conn.recv() for conn in self.connections]
+            done += nr_epoch_gens
+
+            for island, (best, emigrants) in enumerate(results):
+                self.island_best[island].extend(best)
+            self.global_best.extend(
+                max(bests) for bests in zip(*[best for best, emigrants in results])
+            )
+            self.history.append(
+                (
+                    time.perf_counter() - start_time,
+                    [best[-1] for best, emigrants in results],
+                )
+            )
+
+            # Migrate, unless the run is over
+            if done < nr_gens and self.nr_migrants > 0:
+                migrants = [[] for i in range(self.nr_islands)]
+                for island, (best, emigrants) in enumerate(results):
+                    for target in self.targets[island]:
+                        migrants[target].extend(emigrants)
+                for conn, island_migrants in zip(self.connections, migrants):
+                    if len(island_migrants) > 0:
+                        conn.send(("immigrate", island_migrants))
+
+        return self.island_best, self.global_best
+
+    def best(self):
+        # Flat genome and fitness of the best Individual on any island
+        for conn in self.connections:
+            conn.send(("best", None))
+        return max((conn.recv() for conn in self.connections), key=lambda m: m[1])
+
+    def close(self):
+        # Stop all island processes
+        for conn, process in zip(self.connections, self.processes):
+            conn.send(("stop", None))
+            process.join()
+            conn.close()
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled, integer indexed representation of a road network and its car routes.
+"""
+
+from collections import defaultdict
+import os
+
+import numpy as np
+
+from instrumentation import profiler
+
+
+class RoadNetwork:
+    def __init__(
+        self,
+        street_names,
+        street_start,
+        street_end,
+        street_length,
+        path_offsets,
+        path_streets,
+        nr_iters,
+        score_per_car,
+        scheduled=None,
+        fixed_timing=None,
+    ):
+        """
+        Class to hold a road network with streets interned to dense integer ids.
+        Street end intersections and lengths are stored in arrays indexed by street
+        id, and all routes are stored back to back in CSR form: the streets of
+        car c are path_streets[path_offsets[c]:path_offsets[c + 1]].
+
+        Intersections with incoming streets are numbered in order of their first
+        appearance as a street end, like the keys of Simulation.intersections,
+        and their incoming streets are listed in CSR form in the same way.
+
+        Only scheduled streets have a light, and only the timings of scheduled
+        streets without a fixed timing are set by a genome. The genome holds
+        the free timings of the free_ints intersections in CSR form, with
+        offsets free_offsets. By default every street is scheduled and free.
+
+        Parameters
+        ----------
+        street_names : list
+            street identifiers, indexed by street id.
+        street_start : array_like or None
+            intersection identifier where each street starts, or None if unknown.
+        street_end : array_like
+            intersection identifier where each street ends.
+        street_length : array_like
+            length of each street.
+        path_offsets : array_like
+            start of the route of every car in path_streets, followed by the
+            total number of route entries.
+        path_streets : array_like
+            street ids of all routes, back to back.
+        nr_iters : int
+            integer setting the number of iterations for a single simulation.
+        score_per_car : int
+            integer setting the score gained per car that completes its route.
+        scheduled : array_like, optional
+            whether each street has a light. Cars must never wait on a street
+            without one. The default is None, for all streets.
+        fixed_timing : array_like, optional
+            timing of each street, or -1 if the genome sets it. The default is
+            None, for all -1.
+
+        """
+        self.street_names = list(street_names)
+        self.street_index = {name: i for i, name in enumerate(self.street_names)}
+        self.street_start = (
+            None if street_start is None else np.asarray(street_start, dtype=np.int64)
+        )
+        self.street_end = np.asarray(street_end, dtype=np.int64)
+        self.street_length = np.asarray(street_length, dtype=np.int64)
+        self.path_offsets = np.asarray(path_offsets, dtype=np.int64)
+        self.path_streets = np.asarray(path_streets, dtype=np.int64)
+        self.path_lengths = np.diff(self.path_offsets)
+        self.nr_iters = nr_iters
+        self.score_per_car = score_per_car
+        self.scheduled = (
+            np.ones(len(self.street_end), dtype=bool)
+            if scheduled is None
+            else np.asarray(scheduled, dtype=bool)
+        )
+        self.fixed_timing = (
+            np.full(len(self.street_end), -1, dtype=np.int64)
+            if fixed_timing is None
+            else np.asarray(fixed_timing, dtype=np.int64)
+        )
+
+        # Number intersections with scheduled incoming streets by first
+        # appearance. Streets without a light belong to no intersection.
+        ends, first = np.unique(self.street_end[self.scheduled], return_index=True)
+        self.int_ids = ends[np.argsort(first)]
+        dense = np.full(
+            self.street_end.max() + 1 if len(self.street_end) > 0 else 0,
+            -1,
+            dtype=np.int64,
+        )
+        dense[self.int_ids] = np.arange(len(self.int_ids))
+        self.street_int = np.where(self.scheduled, dense[self.street_end], -1)
+
+        # Incoming streets per intersection, in order of street id.
+        lit = np.flatnonzero(self.scheduled)
+        self.in_streets = lit[np.argsort(self.street_int[lit], kind="stable")]
+        self.in_degree = np.bincount(
+            self.street_int[lit], minlength=len(self.int_ids)
+        )
+        self.in_offsets = np.zeros(len(self.int_ids) + 1, dtype=np.int64)
+        np.cumsum(self.in_degree, out=self.in_offsets[1:])
+        self.slot_int = np.repeat(np.arange(len(self.int_ids)), self.in_degree)
+
+        # Slots whose timing the genome sets, and the intersections they belong to.
+        self.slot_fixed = self.fixed_timing[self.in_streets]
+        self.free_slots = np.flatnonzero(self.slot_fixed < 0)
+        free_degree = np.bincount(
+            self.slot_int[self.free_slots], minlength=len(self.int_ids)
+        )
+        self.free_ints = np.flatnonzero(free_degree > 0)
+        self.free_offsets = np.zeros(len(self.free_ints) + 1, dtype=np.int64)
+        np.cumsum(free_degree[self.free_ints], out=self.free_offsets[1:])
+
+        # Least number of iterations between passing the light at the end of each
+        # route entry and finishing: the travel times of the streets in between,
+        # which Simulation takes from the end intersection. -1 where one of those
+        # streets has a travel time of 0, so the car can never finish.
+        route_end = np.repeat(self.path_offsets[1:] - 1, self.path_lengths)
+        last = self.path_offsets[1:][self.path_lengths > 0] - 1
+        travel = self.street_end[self.path_streets]
+        stuck = travel == 0
+        travel[last] = 0
+        stuck[last] = False
+        stuck = np.cumsum(stuck)
+        travel = np.cumsum(travel)
+        self.route_remaining = np.where(
+            stuck[route_end] - stuck > 0, -1, travel[route_end] - travel
+        )
+
+    def expand_genome(self, genome):
+        # Timings of all slots, in slot order, from the free timings of a genome.
+        # Works on a single genome as well as on a batch of genomes stacked along
+        # the first axis.
+        genome = np.asarray(genome, dtype=np.int64)
+        if len(self.free_slots) == len(self.slot_fixed):
+            return genome
+        durations = np.empty(genome.shape[:-1] + self.slot_fixed.shape, dtype=np.int64)
+        durations[...] = self.slot_fixed
+        durations[..., self.free_slots] = genome
+        return durations
+
+    @classmethod
+    def from_dicts(cls, streets, paths, nr_iters, score_per_car):
+        # Compile the street dict and path lists used by Simulation. The street
+        # dict does not say where streets start, so there is no adjacency.
+        street_index = {name: i for i, name in enumerate(streets)}
+        path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in paths], out=path_offsets[1:])
+        return cls(
+            list(streets),
+            None,
+            [end for end, length in streets.values()],
+            [length for end, length in streets.values()],
+            path_offsets,
+            [street_index[name] for path in paths for name in path],
+            nr_iters,
+            score_per_car,
+        )
+
+    @classmethod
+    def from_string(cls, data):
+        # Compile a city plan in hashcode input format. All street lines are
+        # split into tokens at once, and each column is converted in one go.
+        lines = data.splitlines()
+        D, I, S, V, F = map(int, lines[0].split())
+
+        street_tokens = " ".join(lines[1 : 1 + S]).split()
+        street_names = street_tokens[2::4]
+        street_index = {name: i for i, name in enumerate(street_names)}
+
+        # Routes are read per line, skipping the count in front. Generated city
+        # plans do not always get that count right.
+        routes = [line.split()[1:] for line in lines[1 + S :] if line.strip()]
+        path_offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum([len(route) for route in routes], out=path_offsets[1:])
+
+        return cls(
+            street_names,
+            np.array(street_tokens[0::4], dtype=np.int64),
+            np.array(street_tokens[1::4], dtype=np.int64),
+            np.array(street_tokens[3::4], dtype=np.int64),
+            path_offsets,
+            [street_index[name] for route in routes for name in route],
+            D,
+            F,
+        )
+
+    @classmethod
+    def from_file(cls, filename, cache=True):
+        # Compile a city plan file in hashcode input format. With cache, the
+        # compiled arrays are stored in a sidecar file next to the plan, and
+        # loaded from there as long as the plan itself is unchanged.
+        with profiler.phase("parse"):
+            if not cache:
+                with open(filename, "r") as f:
+                    return cls.from_string(f.read())
+
+            cache_file = filename + ".npz"
+            source = os.stat(filename)
+            if os.path.exists(cache_file):
+                network = cls.load(cache_file, source)
+                if network is not None:
+                    return network
+
+            with open(filename, "r") as f:
+                network = cls.from_string(f.read())
+            try:
+                network.save(cache_file, source)
+            except OSError:
+                # A read-only data directory only costs the speedup.
+                pass
+            return network
+
+    def save(self, filename, source=None):
+        # Write the compiled arrays to a .npz file. Source is the os.stat result
+        # of the plan file, recorded to tell whether the cache is still valid.
+        # The file is written under a temporary name and then moved in place, so
+        # a reader never sees a half written cache.
+        arrays = {
+            "street_names": np.array(self.street_names),
+            "street_end": self.street_end,
+            "street_length": self.street_length,
+            "path_offsets": self.path_offsets,
+            "path_streets": self.path_streets,
+            "parameters": np.array([self.nr_iters, self.score_per_car]),
+            "source": np.array(
+                [-1, -1] if source is None else [source.st_size, source.st_mtime_ns]
+            ),
+        }
+        if self.street_start is not None:
+            arrays["street_start"] = self.street_start
+        if not self.scheduled.all() or len(self.free_slots) < len(self.slot_fixed):
+            arrays["scheduled"] = self.scheduled
+            arrays["fixed_timing"] = self.fixed_timing
+
+        temp_file = filename + ".tmp"
+        with open(temp_file, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp_file, filename)
+
+    @classmethod
+    def load(cls, filename, source=None):
+        # Read a network written by save. When source is given, return None if
+        # the cache was not made from a plan file with the same size and
+        # modification time.
+        with np.load(filename) as arrays:
+            if source is not None:
+                size, mtime = arrays["source"].tolist()
+                if size != source.st_size or mtime != source.st_mtime_ns:
+                    return None
+
+            nr_iters, score_per_car = arrays["parameters"].tolist()
+            return cls(
+                arrays["street_names"].tolist(),
+                arrays["street_start"] if "street_start" in arrays else None,
+                arrays["street_end"],
+                arrays["street_length"],
+                arrays["path_offsets"],
+                arrays["path_streets"],
+                nr_iters,
+                score_per_car,
+                arrays["scheduled"] if "scheduled" in arrays else None,
+                arrays["fixed_timing"] if "fixed_timing" in arrays else None,
+            )
+
+    def route_statistics(self):
+        # One pass over all routes. Returns, per street id, the number of cars
+        # that wait at its light and can get there before the end of a run, and
+        # the first iteration in which any car can get there, which is nr_iters
+        # if none can. Arrivals assume every light is green, so they are the
+        # earliest possible. Cars do not wait at the end of their last street.
+        first = np.repeat(self.path_offsets[:-1], self.path_lengths)
+        starts = self.path_offsets[:-1][self.path_lengths > 0]
+        travel = self.street_end[self.path_streets]
+        travel[starts] = 0
+        # A car gets stuck on any street after its first with a travel time of 0.
+        stuck = travel == 0
+        stuck[starts] = False
+        stuck = np.cumsum(stuck)
+        travel = np.cumsum(travel)
+        arrival = travel - travel[first]
+
+        waits = (stuck - stuck[first] == 0) & (arrival < self.nr_iters)
+        waits[self.path_offsets[1:][self.path_lengths > 0] - 1] = False
+
+        usage = np.bincount(
+            self.path_streets[waits], minlength=len(self.street_names)
+        )
+        first_arrival = np.full(len(self.street_names), self.nr_iters, dtype=np.int64)
+        np.minimum.at(first_arrival, self.path_streets[waits], arrival[waits])
+        return usage, first_arrival
+
+    def proxy(self, nr_iters=None, car_ids=None):
+        # Cheaper network to screen schedules on: the same streets, and so the
+        # same genome layout, with a shorter horizon and only the routes of the
+        # given cars.
+        if car_ids is None:
+            car_ids = np.arange(len(self.path_lengths))
+        lengths = self.path_lengths[car_ids]
+        path_offsets = np.zeros(len(car_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=path_offsets[1:])
+        entries = np.repeat(self.path_offsets[car_ids] - path_offsets[:-1], lengths)
+        entries += np.arange(path_offsets[-1])
+        return RoadNetwork(
+            self.street_names,
+            self.street_start,
+            self.street_end,
+            self.street_length,
+            path_offsets,
+            self.path_streets[entries],
+            self.nr_iters if nr_iters is None else nr_iters,
+            self.score_per_car,
+            self.scheduled,
+            self.fixed_timing,
+        )
+
+    def street_dict(self):
+        # Street dict for Simulation, using street ids as identifiers.
+        return {
+            street: (end, length)
+            for street, (end, length) in enumerate(
+                zip(self.street_end.tolist(), self.street_length.tolist())
+            )
+        }
+
+    def path_lists(self):
+        # Routes of all cars as lists of street ids.
+        path_streets = self.path_streets.tolist()
+        offsets = self.path_offsets.tolist()
+        return [path_streets[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def intersection_dict(self):
+        # Undirected graph of intersections, as built by utils.parse_input. Each
+        # pair of connected intersections is linked once, in order of the first
+        # street between them.
+        if self.street_start is None:
+            raise ValueError("Network does not know where streets start.")
+
+        low = np.minimum(self.street_start, self.street_end)
+        high = np.maximum(self.street_start, self.street_end)
+        _, first = np.unique(
+            np.stack([low, high], axis=1), axis=0, return_index=True
+        )
+        first = np.sort(first)
+
+        intersection_dict = defaultdict(list)
+        for fr, to in zip(
+            self.street_start[first].tolist(), self.street_end[first].tolist()
+        ):
+            intersection_dict[to].append(fr)
+            intersection_dict[fr].append(to)
+        return intersection_dict
+
+    @property
+    def nbytes(self):
+        # Memory used by the arrays of the network
+        arrays = [
+            self.street_end,
+            self.street_length,
+            self.path_offsets,
+            self.path_streets,
+            self.street_int,
+            self.in_streets,
+            self.in_offsets,
+        ]
+        if self.street_start is not None:
+            arrays.append(self.street_start)
+        return sum(array.nbytes for array in arrays)
+
+
+class NetworkReduction:
+    def __init__(self, network):
+        """
+        Class to compile a RoadNetwork down to the part that can affect the
+        score, and to map genomes of the reduced network back to the full one.
+
+        Streets on no route are dropped. Streets no car can wait on before the
+        end of a run lose their light, so intersections without such a street
+        drop out of the genome. An intersection with a single street that cars
+        wait on is always green for it, so that street gets a fixed timing of 1.
+        The genome of the reduced network only holds the remaining timings.
+
+        Expanded to the full network, dropped streets get a timing of 0, so they
+        never turn green, and the full network scores the schedule the same as
+        the reduced one.
+
+        Parameters
+        ----------
+        network : RoadNetwork
+            full network to reduce.
+
+        """
+        self.full = network
+        usage = network.route_statistics()[0]
+
+        # Streets on some route, renumbered in order of their full id.
+        self.street_ids = np.flatnonzero(
+            np.bincount(network.path_streets, minlength=len(network.street_names)) > 0
+        )
+        reduced_id = np.full(len(network.street_names), -1, dtype=np.int64)
+        reduced_id[self.street_ids] = np.arange(len(self.street_ids))
+
+        # Streets cars wait on keep their light. The only one at an intersection
+        # is always green.
+        used = usage[self.street_ids] > 0
+        ends = network.street_end[self.street_ids]
+        nr_used = np.bincount(ends[used], minlength=network.street_end.max() + 1)
+        fixed_timing = np.where(used & (nr_used[ends] == 1), 1, -1)
+
+        self.network = RoadNetwork(
+            [network.street_names[i] for i in self.street_ids.tolist()],
+            None
+            if network.street_start is None
+            else network.street_start[self.street_ids],
+            ends,
+            network.street_length[self.street_ids],
+            network.path_offsets,
+            reduced_id[network.path_streets],
+            network.nr_iters,
+            network.score_per_car,
+            used,
+            fixed_timing,
+        )
+
+        # Full genome slot of every timing of the reduced genome, and the full
+        # genome with every fixed timing filled in.
+        reduced = self.network
+        full_slot = np.empty(len(network.street_names), dtype=np.int64)
+        full_slot[network.in_streets] = np.arange(len(network.in_streets))
+        self.gene_slots = full_slot[
+            self.street_ids[reduced.in_streets[reduced.free_slots]]
+        ]
+        self.base = np.zeros(len(network.in_streets), dtype=np.int64)
+        fixed = reduced.in_streets[reduced.slot_fixed >= 0]
+        self.base[full_slot[self.street_ids[fixed]]] = reduced.fixed_timing[fixed]
+
+    def expand(self, genome):
+        # Full genome from a genome of the reduced network. Works on a single
+        # genome as well as on a batch of genomes stacked along the first axis.
+        genome = np.asarray(genome)
+        full = np.empty(genome.shape[:-1] + self.base.shape, dtype=genome.dtype)
+        full[...] = self.base
+        full[..., self.gene_slots] = genome
+        return full
+
+    def reduce(self, genome):
+        # Genome of the reduced network from a full genome
+        return np.asarray(genome)[..., self.gene_slots]
+
+    def expand_schedules(self, genome):
+        # Dict using the intersection identifiers of the full network as keys and
+        # a list of timings, in schedule order, as values.
+        timings = self.expand(genome).tolist()
+        offsets = self.full.in_offsets.tolist()
+        return {
+            int_id: timings[offsets[i] : offsets[i + 1]]
+            for i, int_id in enumerate(self.full.int_ids.tolist())
+        }
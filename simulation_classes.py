@@ -6,11 +6,68 @@ Created on Mon May  3 09:08:40 2021
 """
 
 from collections import defaultdict, deque
+import io
 import random
 
 import numpy as np
 from tqdm import trange
 
+from network import RoadNetwork
+
+# Number of times per full run that the upper bound on the final score is
+# checked, to stop runs that can no longer change their score or that are pruned.
+BOUND_CHECKS = 32
+
+
+class CompiledSchedule:
+    def __init__(self, schedule):
+        """
+        Class to hold the periodic form of an intersection schedule, so that the
+        green light at any iteration can be found without stepping through the cycle.
+        Stores the cycle length, the offset and green duration of every street
+        within the cycle, and a lookup table with the green street per position.
+
+        Follows the cycling of Intersection: a street with timing 0 is left out
+        of the cycle and never turns green, like a street left out of a
+        submission. An intersection with only such streets is always red.
+
+        Parameters
+        ----------
+        schedule : dict
+            dictionary using street names as keys and timings as values, in the
+            order in which the streets turn green.
+
+        """
+        self.offsets = {}
+        self.durations = {}
+        self.table = []
+        for street_name, sched_time in schedule.items():
+            self.offsets[street_name] = len(self.table)
+            self.durations[street_name] = sched_time
+            self.table.extend([street_name] * sched_time)
+        self.cycle_length = len(self.table)
+
+    def green_at(self, t):
+        # Street that is green at iteration t, or None if all are red
+        if self.cycle_length == 0:
+            return None
+        return self.table[t % self.cycle_length]
+
+    def is_green(self, street_name, t):
+        # Check if street is green at iteration t
+        return self.green_at(t) == street_name
+
+    def next_green(self, street_name, t):
+        # First iteration from t onwards at which street is green, or None if it
+        # never turns green
+        if self.durations[street_name] == 0:
+            return None
+        position = t % self.cycle_length
+        start = self.offsets[street_name]
+        if start <= position < start + self.durations[street_name]:
+            return t
+        return t + (start - position) % self.cycle_length
+
 
 class Intersection:
     def __init__(self):
@@ -23,61 +80,74 @@ class Intersection:
         self.schedule = defaultdict(int)
         # Initialize queues as dict of queues with street names as keys
         self.queues = defaultdict(deque)
-        # Initialize counter for schedule cycling
+        # Initialize the cycle, empty until a street is added
+        self.cycle = []
+        # Initialize counter and position within the cycle for schedule cycling
         self.counter = 0
+        self.position = 0
+        # Compiled form of the schedule, built on demand
+        self.compiled = None
 
     def add_incoming(self, street_name, sched_time=1):
         # Add an incoming street to the intersection
         self.schedule[street_name] = sched_time
         self.cycle = self.sched_to_cycle()
         self.queues[street_name] = deque()
+        self.compiled = None
 
     def set_schedule(self, street_name, sched_time):
-        # Change the timing for a certain street
+        # Change the timing for a certain street. The cycle may have lost or
+        # gained streets, so it starts over.
         self.schedule[street_name] = sched_time
         self.cycle = self.sched_to_cycle()
+        self.counter = 0
+        self.position = 0
+        self.compiled = None
+
+    def compile_schedule(self):
+        # Return the compiled schedule, rebuilding it if the schedule changed
+        if self.compiled is None:
+            self.compiled = CompiledSchedule(self.schedule)
+        return self.compiled
+
+    def is_green(self, street_name, t):
+        # Check if a street is green at iteration t, counted from the last reset
+        return self.compile_schedule().is_green(street_name, t)
+
+    def next_green(self, street_name, t):
+        # First iteration from t onwards, counted from the last reset, at which
+        # a street is green, or None if it never turns green
+        return self.compile_schedule().next_green(street_name, t)
 
     def add_to_queue(self, street_name, car):
         # Add a car into the queue from a certain street
         self.queues[street_name].append(car)
 
     def sched_to_cycle(self):
-        # Reset cycle to match most recent schedule
-        return deque(self.schedule.items())
+        # Reset cycle to match most recent schedule. Streets with timing 0 are
+        # left out, so they never turn green.
+        return [
+            (street_name, sched_time)
+            for street_name, sched_time in self.schedule.items()
+            if sched_time > 0
+        ]
 
     def reset(self):
         # Reset entire intersection, clearing all queues and setting counter to 0
         self.counter = 0
-        self.cycle = self.sched_to_cycle()
-        for street in self.queues:
-            self.queues[street] = deque([])
-
-
-class Car:
-    def __init__(self, path):
-        """
-        Class to hold important information on a single vehicle.
-        Stores the distance to the next intersection, as well as the route.
-
-        Parameters
-        ----------
-        path : list
-            path contains an *ordered* list of street
-            identifiers which the car wants to visit.
-        """
-        self.path = deque(path)
-
-        self.current_street = self.path[0]
-        self.path.popleft()
-        self.distance_to_next = 0
+        self.position = 0
+        for queue in self.queues.values():
+            queue.clear()
 
 
 class Simulation:
-    def __init__(self, streets, paths, score_per_car, nr_iters):
+    def __init__(self, streets, paths, score_per_car, nr_iters, lights=None):
         """
         Class used to efficiently run simulations.
-        Stores a list of Car and Intersection objects, as well as a dict
-        of streets, their identifiers and the intersections at which they end.
+        Stores a dict of Intersection objects, as well as a dict of streets,
+        their identifiers and the intersections at which they end.
+        The state of every car, its position along its path and the distance
+        to the next intersection, is kept in flat lists indexed by car id.
 
         Also stores simulation parameters: number of iterations in a full run,
         scores gained per car.
@@ -93,12 +163,16 @@ class Simulation:
             integer setting the score gained per car that completes its route.
         nr_iters : int
             integer setting the number of iterations for a single simulation.
+        lights : set, optional
+            identifiers of the streets that have a light. Cars must never wait
+            on any other street. The default is None, for all streets.
 
         """
         # Set parameters and store those necessary for resetting.
         self.streets = streets
+        # Compiled network the simulation was built from, if any.
+        self.network = None
         self.intersections = defaultdict(Intersection)
-        self.cars = defaultdict(Car)
         self.score = 0
         self.score_per_car = score_per_car
         self.current_iter = 0
@@ -107,65 +181,96 @@ class Simulation:
 
         # Build dict of Intersection objects using street dict
         for k, v in self.streets.items():
-            self.intersections[v[0]].add_incoming(k)
-
-        # Build dict of Car objects using paths
-        for i, path in enumerate(paths):
-            car = Car(path)
-            self.cars[i] = car
-            # Cars start waiting at the end of their first street, so queue them up.
-            self.get_in_queue(i)
+            if lights is None or k in lights:
+                self.intersections[v[0]].add_incoming(k)
+
+        # Store every path once. A car's current street is the street at its
+        # position along its path.
+        self.paths = [tuple(path) for path in paths]
+        # Least number of iterations from passing each light on a path to
+        # finishing, see RoadNetwork.route_remaining. Compiled when first needed.
+        self.route_remaining = None
+        self.capture_initial_state()
+        self.reset()
+
+    @classmethod
+    def from_network(cls, network):
+        # Build a simulation on a compiled RoadNetwork. Streets are identified
+        # by their integer ids, which are cheaper to hash than names.
+        sim = cls(
+            network.street_dict(),
+            network.path_lists(),
+            network.score_per_car,
+            network.nr_iters,
+            set(np.flatnonzero(network.scheduled).tolist()),
+        )
+        sim.network = network
+        return sim
+
+    def capture_initial_state(self):
+        # Cars start waiting at the end of their first street, at distance 0.
+        # Record the state once, so reset only has to copy it back.
+        self.initial_cars = dict.fromkeys(range(len(self.paths)))
+        self.initial_position = [0] * len(self.paths)
+        self.initial_distance = [0] * len(self.paths)
+        initial_queues = defaultdict(list)
+        for car_id, path in enumerate(self.paths):
+            initial_queues[path[0]].append(car_id)
+        self.initial_queues = [
+            (self.intersections[self.streets[street_name][0]].queues[street_name], car_ids)
+            for street_name, car_ids in initial_queues.items()
+        ]
+        # Queues that may hold cars and need clearing on reset
+        self.used_queues = [queue for queue, car_ids in self.initial_queues]
 
     def iterate_intersection(self, int_id):
+        intersection = self.intersections[int_id]
+        # All lights stay red if every timing is 0
+        if len(intersection.cycle) == 0:
+            return
         # Check if light changes
-        if self.intersections[int_id].counter >= self.intersections[int_id].cycle[0][1]:
-            self.intersections[int_id].cycle.rotate(-1)
-            self.intersections[int_id].counter = 0
+        if intersection.counter >= intersection.cycle[intersection.position][1]:
+            intersection.position = (intersection.position + 1) % len(intersection.cycle)
+            intersection.counter = 0
 
         # Let through any waiting car
-        if (
-            len(
-                self.intersections[int_id].queues[
-                    self.intersections[int_id].cycle[0][0]
-                ]
-            )
-            > 0
-        ):
-            self.pass_green(
-                self.intersections[int_id].queues[
-                    self.intersections[int_id].cycle[0][0]
-                ][0]
-            )
-            self.intersections[int_id].queues[
-                self.intersections[int_id].cycle[0][0]
-            ].popleft()
+        queue = intersection.queues[intersection.cycle[intersection.position][0]]
+        if len(queue) > 0:
+            self.pass_green(queue.popleft())
 
         # Increment counter
-        self.intersections[int_id].counter += 1
+        intersection.counter += 1
 
     def iterate_car(self, car_id):
         # If a car still needs to travel before hitting a light, do so.
-        if self.cars[car_id].distance_to_next > 0:
-            self.cars[car_id].distance_to_next -= 1
+        if self.car_distance[car_id] > 0:
+            self.car_distance[car_id] -= 1
             # If a car reaches distance 0, it has to queue up for the light.
-            if self.cars[car_id].distance_to_next == 0:
+            if self.car_distance[car_id] == 0:
                 self.get_in_queue(car_id)
 
     def get_in_queue(self, car_id):
-        # Put a Car in the correct queue of the correct Intersection
-        street_name = self.cars[car_id].current_street
+        # Put a car in the correct queue of the correct Intersection
+        street_name = self.paths[car_id][self.car_position[car_id]]
         int_id = self.streets[street_name][0]
-        self.intersections[int_id].add_to_queue(street_name, car_id)
+        # Cars only reach streets without a light when no time is left to pass
+        # them, so they do not queue there. The lookup must not add an
+        # intersection either.
+        intersection = self.intersections.get(int_id)
+        if intersection is None or street_name not in intersection.schedule:
+            return
+        queue = intersection.queues[street_name]
+        if len(queue) == 0:
+            self.used_queues.append(queue)
+        queue.append(car_id)
 
     def pass_green(self, car_id):
         # Update street
-        self.cars[car_id].current_street = self.cars[car_id].path[0]
-        self.cars[car_id].path.popleft()
-        if len(self.cars[car_id].path) > 0:
+        self.car_position[car_id] += 1
+        path = self.paths[car_id]
+        if self.car_position[car_id] < len(path) - 1:
             # Move car onto next street if it is not its last street
-            self.cars[car_id].distance_to_next = self.streets[
-                self.cars[car_id].current_street
-            ][0]
+            self.car_distance[car_id] = self.streets[path[self.car_position[car_id]]][0]
         else:
             # If car has reached its last street, treat as finished and update score. Then remove car from simulation.
             self.score += self.score_per_car
@@ -181,28 +286,106 @@ class Simulation:
             self.iterate_car(car_id)
         self.current_iter += 1
 
-    def full_run(self, verbose=False):
-        # Do a full run of the simulation.
-        if verbose == True:
-            for i in trange(0, self.nr_iters):
-                self.iterate()
-        else:
-            for i in range(0, self.nr_iters):
-                self.iterate()
+    def full_run(self, verbose=False, threshold=None):
+        # Do a full run of the simulation. The run stops early once no car that
+        # is left can still finish. With a threshold, it is also aborted once the
+        # upper bound on its score drops below the threshold. The bound is then
+        # returned instead of the score, and pruned is set.
+        interval = max(1, -(-self.nr_iters // BOUND_CHECKS))
+        iterations = trange(0, self.nr_iters) if verbose == True else range(0, self.nr_iters)
+        for i in iterations:
+            if len(self.cars) == 0:
+                break
+            if self.current_iter % interval == 0:
+                bound = self.score_bound()
+                if bound == self.score:
+                    break
+                if threshold is not None and bound < threshold:
+                    self.pruned = True
+                    return bound
+            self.iterate()
         return self.score
 
-    def reset(self):
-        # Reset the simulation to its initial state.
+    def score_bound(self):
+        # Upper bound on the final score: the current score, plus what every car
+        # left would score if all lights it still meets were green when it got
+        # there. A car can pass its light when it reaches the end of its street.
+        if self.route_remaining is None:
+            network = self.network
+            if network is None:
+                network = RoadNetwork.from_dicts(
+                    self.streets, self.original_paths, self.nr_iters, self.score_per_car
+                )
+            remaining = network.route_remaining.tolist()
+            offsets = network.path_offsets.tolist()
+            self.route_remaining = [
+                remaining[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+
+        bound = self.score
+        for car_id in self.cars.keys():
+            position = self.car_position[car_id]
+            distance = self.car_distance[car_id]
+            remaining = self.route_remaining[car_id][position]
+            # Cars on a street with a travel time of 0 never reach its light.
+            if remaining < 0 or (
+                distance == 0
+                and position > 0
+                and self.streets[self.paths[car_id][position]][0] == 0
+            ):
+                continue
+            finish = self.current_iter + distance + remaining
+            if finish < self.nr_iters:
+                bound += self.score_per_car + self.nr_iters - finish
+        return bound
+
+    def run_counters(self):
+        # Iterations simulated, streets passed by all cars together and number
+        # of cars that finished, since the last reset.
+        return {
+            "ticks": self.current_iter,
+            "cars_passed": sum(self.car_position),
+            "cars_finished": len(self.paths) - len(self.cars),
+        }
+
+    def load_schedules(self, schedules):
+        # Set the schedule of every intersection from a dict using intersection
+        # identifiers as keys and a list of timings, in schedule order, as values.
+        for int_id, intersection in self.intersections.items():
+            for i, street in enumerate(intersection.schedule.keys()):
+                intersection.set_schedule(street, schedules[int_id][i])
+
+    def load_genome(self, genome):
+        # Set all timings from one flat sequence, ordered by intersection and
+        # then by schedule. On a network, the sequence holds its free timings.
+        if self.network is not None:
+            genome = self.network.expand_genome(genome).tolist()
+        genome = iter(genome)
         for intersection in self.intersections.values():
-            intersection.reset()
+            for street in intersection.schedule.keys():
+                intersection.set_schedule(street, int(next(genome)))
 
-        for i, path in enumerate(self.original_paths):
-            car = Car(path)
-            self.cars[i] = car
-            self.get_in_queue(i)
+    def reset(self):
+        # Reset the simulation to its initial state by copying back the state
+        # recorded in capture_initial_state. Only queues that held cars are cleared.
+        for intersection in self.intersections.values():
+            intersection.counter = 0
+            intersection.position = 0
+        for queue in self.used_queues:
+            queue.clear()
+        for queue, car_ids in self.initial_queues:
+            queue.extend(car_ids)
+        self.used_queues = [queue for queue, car_ids in self.initial_queues]
+
+        # Copying the initial car dict also keeps cars iterated in order of id.
+        self.cars = self.initial_cars.copy()
+        self.car_position = self.initial_position.copy()
+        self.car_distance = self.initial_distance.copy()
 
         self.score = 0
         self.current_iter = 0
+        # Whether the last run was aborted by its score bound
+        self.pruned = False
 
 
 class Grid:
@@ -243,12 +426,38 @@ class Grid:
             # consider width the number of intersections
             self.num_intersections = width
 
-    def random_neighbors(self, id, min_neighbors, max_neighbors):
-        n_neighbors = random.randrange(min_neighbors, max_neighbors)
-        intersections = np.arange(start=0, stop=self.num_intersections, step=1)
-        intersections = np.delete(intersections, id)
-        neighbors_choice = np.random.choice(intersections, n_neighbors, replace=False)
-        return neighbors_choice
+    def random_neighbors(self, min_neighbors, max_neighbors):
+        """Samples the incoming streets of all intersections at once
+
+        Every intersection gets between min_neighbors and max_neighbors distinct
+        neighbours, other than itself. Pairs that are drawn twice are drawn again
+        until all streets are unique.
+
+        Args:
+            min_neighbors (int): Minimum number of incoming streets in an intersection.
+            max_neighbors (int): Maximum number of incoming streets in an intersection.
+
+        Returns:
+            2-tuple of np.ndarray: start and end intersection of every street, ordered by end
+        """
+        n = self.num_intersections
+        if max_neighbors > n - 1:
+            raise ValueError(
+                "Max_neighbors must be lower than the number of intersections."
+            )
+        n_neighbors = np.random.randint(min_neighbors, max_neighbors + 1, n)
+        ends = np.repeat(np.arange(n), n_neighbors)
+        # Draw from the other intersections by skipping over the end itself.
+        starts = np.random.randint(0, n - 1, len(ends))
+        starts += starts >= ends
+        while True:
+            _, first = np.unique(ends * n + starts, return_index=True)
+            duplicate = np.ones(len(ends), dtype=bool)
+            duplicate[first] = False
+            if not duplicate.any():
+                return starts, ends
+            redraw = np.random.randint(0, n - 1, np.count_nonzero(duplicate))
+            starts[duplicate] = redraw + (redraw >= ends[duplicate])
 
     def neighbors(self, row, col):
         """Returns neighboring intersections of intersection at specified location
@@ -289,41 +498,51 @@ class Grid:
             string += f"{Grid.alphabet[j]}"
         return string
 
-    def check_streets_inverse_direction(self, street):
-        for s in self.streets.keys():
-            s_name = s.split("-")
-            s_name = s_name[1] + "-" + s_name[0]
-            if s_name == street.name:
-                street_inverse = self.streets[s]
-                return street_inverse.length
-        else:
-            return 0
+    def check_streets_inverse_direction(self, starts, ends):
+        """Finds the street in the opposite direction of every street
 
-    def gen_grid_description_complex(self, min_neighbors, max_neighbors) -> str:
-        """Returns description of the grid in hashcode input format
+        Args:
+            starts (np.ndarray): ID of intersection at start of every street
+            ends (np.ndarray): ID of intersection at end of every street
 
         Returns:
-            str: description of grid
+            np.ndarray: index of the inverse street, or -1 if there is none
         """
+        # Streets are looked up by their (start, end) pair packed into one key.
+        n = self.num_intersections
+        index = {key: i for i, key in enumerate((starts * n + ends).tolist())}
+        return np.array(
+            [index.get(key, -1) for key in (ends * n + starts).tolist()],
+            dtype=np.int64,
+        )
 
-        data = ""
-        for id in range(self.num_intersections):
-            intersection = Grid.Intersection(id)
-            self.grid.append(intersection)
-            neighbors = self.random_neighbors(id, min_neighbors, max_neighbors)
-            for neighbor in neighbors:
-                length = random.randrange(10, 30)
-                street = Grid.Street(neighbor, intersection.id, length)
-                len_inverse_street = self.check_streets_inverse_direction(street)
-
-                if len_inverse_street > 0:
-                    street.length = len_inverse_street
-
-                intersection.in_streets.append(street)
-                self.streets[street.name] = street
-                data += repr(street)
+    def gen_streets_complex(self, min_neighbors, max_neighbors):
+        """Generates the streets of the complex scenario
 
-        return data
+        Stores the start, end, name and length of every street in street_start,
+        street_end, street_names and street_length. A street gets the length of
+        the street in the opposite direction if that was generated before it.
+
+        Args:
+            min_neighbors (int): Minimum number of incoming streets in an intersection.
+            max_neighbors (int): Maximum number of incoming streets in an intersection.
+        """
+        starts, ends = self.random_neighbors(min_neighbors, max_neighbors)
+        lengths = np.random.randint(10, 30, len(starts))
+        inverse = self.check_streets_inverse_direction(starts, ends)
+        earlier = (inverse >= 0) & (inverse < np.arange(len(inverse)))
+        lengths[earlier] = lengths[inverse[earlier]]
+
+        # Names as in gen_street_name, built from the letter code of every intersection.
+        letters = str.maketrans("0123456789", Grid.alphabet[:10])
+        codes = [str(id).translate(letters) for id in range(self.num_intersections)]
+        self.street_names = [
+            f"{codes[start]}-{codes[end]}"
+            for start, end in zip(starts.tolist(), ends.tolist())
+        ]
+        self.street_start = starts
+        self.street_end = ends
+        self.street_length = lengths
 
     def gen_grid_description_simple(self) -> str:
         """Returns description of the grid in hashcode input format
@@ -346,30 +565,51 @@ class Grid:
 
         return data
 
-    def gen_grid_cars_complex(self, amount, operations) -> str:
-        """Returns generated cars in hashcode input format
+    def gen_routes_complex(self, amount, operations):
+        """Generates the routes of the cars in the complex scenario
+
+        A car starts on a random street that leads on, and takes a random outgoing
+        street at each of the next operations intersections it reaches. Its route
+        ends early at an intersection without outgoing streets. Routes are stored
+        in CSR form in path_offsets and path_streets, like in RoadNetwork.
 
         Args:
             amount (int): Number of cars to generate
             operations (int): Number of operations a car is given
-
-        Returns:
-            str: Description of cars and their routes
         """
-        data = ""
-        streets_names = list(self.streets.keys())
-        for c in range(amount):
-            data += f"{operations} "
-            start_point = streets_names[random.randrange(0, len(streets_names))]
-            data += start_point + " "
-            for i in range(operations):
-                next_intersection_id = self.streets[start_point].end
-                intersection = self.grid[next_intersection_id]
-                streets = intersection.in_streets
-                next_point = streets[random.randrange(0, len(streets))].name
-                data += next_point + " "
-            data += "\n"
-        return data
+        starts, ends = self.street_start, self.street_end
+        nr_streets = len(starts)
+        # Outgoing streets of every intersection in CSR form.
+        by_start = np.argsort(starts, kind="stable")
+        out_offsets = np.zeros(self.num_intersections + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(starts, minlength=self.num_intersections), out=out_offsets[1:]
+        )
+
+        # Cars only start on streets that lead on, so every route has a next street.
+        nr_out = np.diff(out_offsets)
+        leading = np.flatnonzero(nr_out[ends] > 0)
+
+        # All cars take their next street at once, -1 after their route ended.
+        routes = np.full((amount, operations + 1), -1, dtype=np.int64)
+        current = leading[np.random.randint(0, len(leading), amount)]
+        routes[:, 0] = current
+        driving = np.ones(amount, dtype=bool)
+        for i in range(1, operations + 1):
+            at = ends[current]
+            driving &= nr_out[at] > 0
+            pick = out_offsets[at] + (np.random.random(amount) * nr_out[at]).astype(
+                np.int64
+            )
+            current = np.where(
+                driving, by_start[np.minimum(pick, nr_streets - 1)], current
+            )
+            routes[driving, i] = current[driving]
+
+        taken = routes >= 0
+        self.path_offsets = np.zeros(amount + 1, dtype=np.int64)
+        np.cumsum(taken.sum(axis=1), out=self.path_offsets[1:])
+        self.path_streets = routes[taken]
 
     def gen_grid_cars(self, amount, operations) -> str:
         """Returns generated cars in hashcode input format
@@ -407,6 +647,94 @@ class Grid:
             data += "\n"
         return data
 
+    def write_hashcode(
+        self,
+        file,
+        duration,
+        num_cars,
+        hops,
+        bonus_points=1000,
+        min_neighbors=4,
+        max_neighbors=4,
+    ):
+        """Generates the city and writes it to a file in hashcode input format
+
+        The complex scenario is generated as arrays and written line by line, so
+        the file is never held in memory as a whole.
+
+        Args:
+            file (file object): Opened text file to write to.
+            duration (int): duration of the simulation.
+            num_cars (int): number of cars.
+            hops (int): number of hops.
+            bonus_points (int, optional): Bonus points we get when car finishes within duration.
+            min_neighbors (int, optional): Minimum number of incoming streets in an intersection. Defaults to 4.
+            max_neighbors (int, optional): Maximum number of incoming streets in an intersection. Defaults to 4.
+        """
+        if self.simple_sceneario:
+            streets = self.gen_grid_description_simple()
+            cars = self.gen_grid_cars(num_cars, hops)
+            file.write(
+                f"{duration} {self.num_intersections} {len(self.streets)} {num_cars} {bonus_points} \n"
+            )
+            file.write(streets)
+            file.write(cars)
+            return
+
+        self.gen_streets_complex(min_neighbors, max_neighbors)
+        self.gen_routes_complex(num_cars, hops)
+        names = self.street_names
+        file.write(
+            f"{duration} {self.num_intersections} {len(names)} {num_cars} {bonus_points}\n"
+        )
+        file.writelines(
+            f"{start} {end} {name} {length}\n"
+            for start, end, name, length in zip(
+                self.street_start.tolist(),
+                self.street_end.tolist(),
+                names,
+                self.street_length.tolist(),
+            )
+        )
+        offsets = self.path_offsets.tolist()
+        streets = self.path_streets.tolist()
+        file.writelines(
+            f"{end - start} {' '.join([names[street] for street in streets[start:end]])}\n"
+            for start, end in zip(offsets[:-1], offsets[1:])
+        )
+
+    def gen_hashcode_file(
+        self,
+        filename,
+        duration,
+        num_cars,
+        hops,
+        bonus_points=1000,
+        min_neighbors=4,
+        max_neighbors=4,
+    ):
+        """Generates the city and streams it to a file in hashcode input format
+
+        Args:
+            filename (str): File to write to.
+            duration (int): duration of the simulation.
+            num_cars (int): number of cars.
+            hops (int): number of hops.
+            bonus_points (int, optional): Bonus points we get when car finishes within duration.
+            min_neighbors (int, optional): Minimum number of incoming streets in an intersection. Defaults to 4.
+            max_neighbors (int, optional): Maximum number of incoming streets in an intersection. Defaults to 4.
+        """
+        with open(filename, "w") as file:
+            self.write_hashcode(
+                file,
+                duration,
+                num_cars,
+                hops,
+                bonus_points,
+                min_neighbors,
+                max_neighbors,
+            )
+
     def gen_hashcode_string(
         self,
         duration,
@@ -433,19 +761,17 @@ class Grid:
         Returns:
             str: Data in string format
         """
-        data = ""
-        if self.simple_sceneario:
-            data += self.gen_grid_description_simple()
-            data += self.gen_grid_cars(num_cars, hops)
-        else:
-            data += self.gen_grid_description_complex(min_neighbors, max_neighbors)
-            data += self.gen_grid_cars_complex(num_cars, hops)
-
-        # prepend info
-        data = (
-            f"{duration} {self.num_intersections} {len(self.streets)} {num_cars} {bonus_points} \n"
-            + data
+        output = io.StringIO()
+        self.write_hashcode(
+            output,
+            duration,
+            num_cars,
+            hops,
+            bonus_points,
+            min_neighbors,
+            max_neighbors,
         )
+        data = output.getvalue()
 
         if save and name:
             file = open(f"./data/{name}", "w+")
@@ -453,3 +779,46 @@ class Grid:
             file.close()
 
         return data
+
+    def gen_network(
+        self,
+        duration,
+        num_cars,
+        hops,
+        bonus_points=1000,
+        min_neighbors=4,
+        max_neighbors=4,
+    ):
+        """Generates a compiled road network
+
+        The complex scenario is compiled straight from its arrays, without going
+        through the hashcode input format.
+
+        Args:
+            duration (int): duration of the simulation.
+            num_cars (int): number of cars.
+            hops (int): number of hops.
+            bonus_points (int, optional): Bonus points we get when car finishes within duration.
+            min_neighbors (int, optional): Minimum number of incoming streets in an intersection. Defaults to 4.
+            max_neighbors (int, optional): Maximum number of incoming streets in an intersection. Defaults to 4.
+
+        Returns:
+            RoadNetwork: Network with the generated streets and routes
+        """
+        if self.simple_sceneario:
+            return RoadNetwork.from_string(
+                self.gen_hashcode_string(duration, num_cars, hops, bonus_points)
+            )
+
+        self.gen_streets_complex(min_neighbors, max_neighbors)
+        self.gen_routes_complex(num_cars, hops)
+        return RoadNetwork(
+            self.street_names,
+            self.street_start,
+            self.street_end,
+            self.street_length,
+            self.path_offsets,
+            self.path_streets,
+            duration,
+            bonus_points,
+        )
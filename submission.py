@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Hashcode submission files: writing the schedules of a genome, and scoring
+submission files on a city plan.
+
+Run from the command line to score submission files, which share one parse of
+the city plan.
+"""
+
+import argparse
+
+import numpy as np
+
+from evo_classes import ENGINES
+from network import RoadNetwork
+
+
+def write_submission(file, network, genome):
+    # Stream the schedules of a flat genome of network to an opened text file in
+    # hashcode output format. Streets with a timing of 0 or without a light are
+    # left out, and so are intersections with no streets left.
+    durations = network.expand_genome(genome)
+    listed = np.flatnonzero(durations > 0)
+    nr_listed = np.bincount(network.slot_int[listed], minlength=len(network.int_ids))
+    offsets = np.zeros(len(nr_listed) + 1, dtype=np.int64)
+    np.cumsum(nr_listed, out=offsets[1:])
+
+    names = network.street_names
+    streets = network.in_streets[listed].tolist()
+    timings = durations[listed].tolist()
+    offsets = offsets.tolist()
+    int_ids = network.int_ids.tolist()
+    file.write(f"{np.count_nonzero(nr_listed)}\n")
+    for i in np.flatnonzero(nr_listed).tolist():
+        file.write(f"{int_ids[i]}\n{nr_listed[i]}\n")
+        file.writelines(
+            f"{names[streets[slot]]} {timings[slot]}\n"
+            for slot in range(offsets[i], offsets[i + 1])
+        )
+
+
+def read_submission(filename, network):
+    # Read a submission file for network. Returns the street ids of all listed
+    # streets, in schedule order per intersection, and their timings.
+    with open(filename, "r") as f:
+        tokens = f.read().split()
+
+    nr_ints = int(tokens[0])
+    position = 1
+    streets = []
+    timings = []
+    for i in range(nr_ints):
+        int_id, nr_streets = int(tokens[position]), int(tokens[position + 1])
+        entries = tokens[position + 2 : position + 2 + 2 * nr_streets]
+        position += 2 + 2 * nr_streets
+        for name, timing in zip(entries[0::2], entries[1::2]):
+            if name not in network.street_index:
+                raise ValueError(f"Street {name} is not in the city plan.")
+            street = network.street_index[name]
+            if network.street_end[street] != int_id:
+                raise ValueError(f"Street {name} does not end at intersection {int_id}.")
+            if int(timing) < 1:
+                raise ValueError(f"Timing of street {name} must be 1 or higher.")
+            streets.append(street)
+            timings.append(int(timing))
+    if len(set(streets)) < len(streets):
+        raise ValueError("Every street can only be listed once.")
+    return np.array(streets, dtype=np.int64), np.array(timings, dtype=np.int64)
+
+
+class SubmissionScorer:
+    def __init__(self, network, engine="event"):
+        """
+        Class to score submission files on one compiled city plan.
+
+        Listed streets get a light in the order of the submission. A street cars
+        wait on that is not listed is always red for the judge, so it gets a
+        timing of 0, which never turns green. Unlisted streets that no car waits
+        on have no light. A submission written by write_submission scores the
+        same as its genome, on the full or the reduced network.
+
+        A simulation is built for every new layout, the streets listed in their
+        order. Submissions with the same layout as the one before only load
+        their timings into the same simulation.
+
+        Parameters
+        ----------
+        network : RoadNetwork
+            city plan to score on.
+        engine : str, optional
+            simulation engine, one of the keys of ENGINES. The default is "event",
+            the fastest for single runs.
+
+        """
+        if engine not in ENGINES:
+            raise ValueError("Engine must be either 'tick', 'vector' or 'event'.")
+        self.network = network
+        self.engine_class = ENGINES[engine]
+        self.waited = network.route_statistics()[0] > 0
+        self.layout = None
+        self.engine = None
+
+    def compile(self, streets):
+        # Network with the streets renumbered so that the listed streets come
+        # first, in schedule order, followed by the unlisted streets cars wait on
+        # and then the other streets, each in order of street id.
+        network = self.network
+        listed = np.zeros(len(network.street_names), dtype=bool)
+        listed[streets] = True
+        unlisted = np.flatnonzero(~listed & self.waited)
+        # Intersections list their streets in order of street id, so unlisted
+        # streets go after the listed ones.
+        order = np.concatenate(
+            [streets, unlisted, np.flatnonzero(~listed & ~self.waited)]
+        )
+        new_id = np.empty(len(order), dtype=np.int64)
+        new_id[order] = np.arange(len(order))
+
+        fixed_timing = np.full(len(order), -1, dtype=np.int64)
+        fixed_timing[len(streets) : len(streets) + len(unlisted)] = 0
+        compiled = RoadNetwork(
+            [network.street_names[street] for street in order.tolist()],
+            None if network.street_start is None else network.street_start[order],
+            network.street_end[order],
+            network.street_length[order],
+            network.path_offsets,
+            new_id[network.path_streets],
+            network.nr_iters,
+            network.score_per_car,
+            np.arange(len(order)) < len(streets) + len(unlisted),
+            fixed_timing,
+        )
+        return compiled
+
+    def score(self, filename):
+        # Score a submission file
+        streets, timings = read_submission(filename, self.network)
+        layout = streets.tobytes()
+        if layout != self.layout:
+            compiled = self.compile(streets)
+            self.engine = self.engine_class.from_network(compiled)
+            self.layout = layout
+            # Listed streets are numbered in submission order, so this is the
+            # submission entry of every timing in the genome.
+            self.genome_order = compiled.in_streets[compiled.free_slots]
+
+        self.engine.reset()
+        self.engine.load_genome(timings[self.genome_order])
+        return int(self.engine.full_run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score hashcode submission files on a city plan."
+    )
+    parser.add_argument(
+        "input", help="City plan in hashcode input format the submissions are for."
+    )
+    parser.add_argument(
+        "submissions", nargs="+", help="Submission files in hashcode output format."
+    )
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        default="event",
+        type=str,
+        help="Simulation engine used for scoring. Needs to be either 'tick', 'vector' or 'event'.",
+    )
+    args = parser.parse_args()
+
+    scorer = SubmissionScorer(RoadNetwork.from_file(args.input), args.engine)
+    for filename in args.submissions:
+        print(f"{filename}: {scorer.score(filename)}")
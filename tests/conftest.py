@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the repository root, next to __main__.py.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from network import RoadNetwork
+
+DATA = os.path.join(ROOT, "data")
+
+
+@pytest.fixture(scope="module", params=["test.in", "complex_test.in"])
+def network(request):
+    # Compiled network of each small city plan in the data folder
+    return RoadNetwork.from_file(os.path.join(DATA, request.param), cache=False)
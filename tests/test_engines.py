@@ -0,0 +1,99 @@
+import numpy as np
+
+from evo_classes import ENGINES
+from network import NetworkReduction, RoadNetwork
+from simulation_classes import Simulation
+
+
+# The second car reaches street d on the last iteration, so d gets no light
+# on reduction.
+UNLIT_CITY = """2 4 6 3 10
+2 1 a 1
+1 0 b 1
+3 0 c 1
+0 2 d 1
+2 0 e 1
+3 1 f 1
+2 e d
+3 c d a
+2 c d
+"""
+
+
+def random_genomes(network, nr_genomes=3, timing_cap=4):
+    # Seeded genomes, including timings of 0
+    rng = np.random.default_rng(0)
+    return rng.integers(
+        0, timing_cap, (nr_genomes, len(network.free_slots)), endpoint=True
+    )
+
+
+def test_engines_give_same_score(network):
+    engines = {name: engine.from_network(network) for name, engine in ENGINES.items()}
+    for genome in random_genomes(network):
+        scores = {}
+        for name, engine in engines.items():
+            engine.reset()
+            engine.load_genome(genome)
+            scores[name] = int(engine.full_run())
+        assert scores["vector"] == scores["tick"]
+        assert scores["event"] == scores["tick"]
+
+
+def test_batch_matches_single_runs(network):
+    genomes = random_genomes(network)
+    tick = Simulation.from_network(network)
+    expected = []
+    for genome in genomes:
+        tick.reset()
+        tick.load_genome(genome)
+        expected.append(int(tick.full_run()))
+
+    vector = ENGINES["vector"].from_network(network)
+    assert vector.run_genomes(list(genomes)) == expected
+
+    # A single schedule after a batch, in either order of reset and load.
+    vector.reset()
+    vector.load_genome(genomes[1])
+    assert vector.full_run() == expected[1]
+    vector.run_genomes(list(genomes))
+    vector.load_genome(genomes[2])
+    vector.reset()
+    assert vector.full_run() == expected[2]
+
+
+def test_reduced_network_runs_twice():
+    reduced = NetworkReduction(RoadNetwork.from_string(UNLIT_CITY)).network
+    genome = np.ones(len(reduced.free_slots), dtype=np.int64)
+    event = ENGINES["event"].from_network(reduced)
+    event.reset()
+    event.load_genome(genome)
+    expected = int(event.full_run())
+
+    tick = Simulation.from_network(reduced)
+    for i in range(2):
+        tick.reset()
+        tick.load_genome(genome)
+        assert tick.full_run() == expected
+
+
+def test_traced_run_from_base_matches_full_run(network):
+    vector = ENGINES["vector"].from_network(network)
+    base_genome = random_genomes(network)[0]
+    vector.load_genome(base_genome)
+    base = vector.traced_run()
+
+    # Change the timing of a light that cars reach before the first
+    # checkpoint, of the light reached last and of a light never reached.
+    touch = base.first_touch[vector.slot_int[network.free_slots]]
+    reached = np.flatnonzero(touch < network.nr_iters)
+    slots = [reached[np.argmin(touch[reached])], reached[np.argmax(touch[reached])]]
+    slots.extend(np.flatnonzero(touch == network.nr_iters)[:1].tolist())
+    for slot in slots:
+        genome = base_genome.copy()
+        genome[slot] = (genome[slot] + 1) % 5
+        vector.load_genome(genome)
+        traced = vector.traced_run(base=base)
+        vector.reset()
+        vector.load_genome(genome)
+        assert traced.score == vector.full_run()
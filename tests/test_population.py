@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+import utils
+from evo_classes import ENGINES, Population
+from network import NetworkReduction, RoadNetwork
+
+
+def population(network, **params):
+    # Small seeded population on network
+    sim, intersection_dict = utils.create_sim_from_network(network)
+    params = dict(dict(gen_size=6, candidate_size=6, mutation_rate=0.2, seed=3), **params)
+    return Population(sim, intersection_dict, **params)
+
+
+def test_resumed_run_matches_uninterrupted_run(network, tmp_path):
+    # The proxy screens on sampled cars, drawn from the random number
+    # generator, and is calibrated on some of the generations.
+    params = dict(
+        engine="event", proxy_horizon=0.5, proxy_cars=0.5, calibrate_every=2
+    )
+    uninterrupted = population(network, **params)
+    uninterrupted.run(5, verbose=False)
+
+    checkpoint = str(tmp_path / "run.npz")
+    first = population(network, **params)
+    first.run(3, verbose=False, checkpoint_file=checkpoint)
+    resumed = population(network, resume_from=checkpoint, **dict(params, seed=None))
+    resumed.run(2, verbose=False)
+
+    assert resumed.generation == uninterrupted.generation
+    assert resumed.best_run == uninterrupted.best_run
+    assert resumed.worst_run == uninterrupted.worst_run
+    assert resumed.mean_run == uninterrupted.mean_run
+    # Calibrations on equal scores have a correlation of nan
+    np.testing.assert_equal(resumed.screen_history, uninterrupted.screen_history)
+    assert (resumed.proxy_car_ids == uninterrupted.proxy_car_ids).all()
+    assert (resumed.fitness == uninterrupted.fitness).all()
+    best = resumed.genome(resumed.individuals[0])
+    assert (best == uninterrupted.genome(uninterrupted.individuals[0])).all()
+
+
+def test_children_leave_parent_genomes_unchanged(network):
+    # Children share the genome blocks of their parents until they mutate, so
+    # every Individual keeps the timings it had when it was selected.
+    pop = population(network, mutation_rate=0.5, engine="event")
+    timings = {}
+    for i in range(5):
+        for individual in pop.individuals:
+            timings.setdefault(individual, pop.genome(individual).copy())
+        pop.next_generation_default()
+        for individual, individual_timings in timings.items():
+            assert (pop.genome(individual) == individual_timings).all()
+
+
+def test_incremental_evaluation_matches_full_runs(network):
+    # Without memory, every trace is evicted as soon as it is stored, so
+    # children are simulated from iteration 0.
+    vector = ENGINES["vector"].from_network(network)
+    for memory in (0, 64):
+        pop = population(network, engine="vector", checkpoint_memory=memory)
+        pop.run(3, verbose=False)
+        assert (len(pop.traces) > 0) == (memory > 0)
+        for individual in pop.individuals:
+            vector.reset()
+            vector.load_genome(pop.genome(individual))
+            assert individual.fitness == vector.full_run()
+
+
+def test_streets_cars_wait_on_are_never_drawn_red(network):
+    # A timing of 0 never turns green, so only streets no car waits on get it.
+    for mode in ("schedule", "individual"):
+        pop = population(
+            network, engine="event", mutation_rate=1.0, mutation_mode=mode
+        )
+        waited = pop.slot_usage > 0
+        for i in range(3):
+            for individual in pop.individuals:
+                assert (pop.genome(individual)[waited] > 0).all()
+            pop.next_generation_default()
+
+
+def test_invalid_arguments_start_no_workers(network, monkeypatch):
+    started = []
+    monkeypatch.setattr("evo_classes.Pool", lambda *args, **kwargs: started.append(args))
+    for params in (dict(init="none"), dict(proxy_cars=2.0), dict(tournament_size=1)):
+        with pytest.raises(ValueError):
+            population(network, n_workers=1, **params)
+    assert started == []
+
+
+def test_calibration_is_not_pruned(network):
+    # Every generation is calibrated, so no child may be scored by a bound.
+    pop = population(
+        network, engine="event", prune=True, proxy_cars=0.5, calibrate_every=1
+    )
+    pop.run(3, verbose=False)
+    assert pop.nr_pruned == 0
+    assert len(pop.screen_history) == 3
+
+
+def test_fixed_network_has_nothing_to_evolve():
+    # Street a is the only street cars wait on at its intersection, so its
+    # timing is fixed on reduction.
+    network = RoadNetwork.from_string("5 3 2 1 10\n0 1 a 1\n1 2 b 1\n2 a b\n")
+    reduced = NetworkReduction(network).network
+    with pytest.raises(ValueError, match="no timings"):
+        population(reduced)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from evo_classes import ENGINES
+from network import NetworkReduction
+from submission import SubmissionScorer, read_submission, write_submission
+
+
+def genome_score(network, genome, engine="event"):
+    sim = ENGINES[engine].from_network(network)
+    sim.reset()
+    sim.load_genome(genome)
+    return int(sim.full_run())
+
+
+def written(network, genome, filename):
+    with open(filename, "w") as f:
+        write_submission(f, network, genome)
+    return filename
+
+
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_written_genome_scores_the_same(network, engine, tmp_path):
+    # Genomes with timings of 0, which the submission leaves out
+    rng = np.random.default_rng(1)
+    scorer = SubmissionScorer(network, engine)
+    for i in range(3):
+        genome = rng.integers(0, 3, len(network.free_slots), endpoint=True)
+        filename = written(network, genome, str(tmp_path / f"{i}.out"))
+        assert scorer.score(filename) == genome_score(network, genome)
+
+
+def test_written_reduced_genome_scores_the_same(network, tmp_path):
+    reduction = NetworkReduction(network)
+    genome = np.random.default_rng(2).integers(
+        0, 3, len(reduction.network.free_slots), endpoint=True
+    )
+    filename = written(reduction.network, genome, str(tmp_path / "reduced.out"))
+    expected = genome_score(reduction.network, genome)
+    assert genome_score(network, reduction.expand(genome)) == expected
+    assert SubmissionScorer(network).score(filename) == expected
+
+
+def test_zero_timings_are_left_out(network, tmp_path):
+    genome = np.zeros(len(network.free_slots), dtype=np.int64)
+    genome[::2] = 1
+    filename = written(network, genome, str(tmp_path / "half.out"))
+    streets, timings = read_submission(filename, network)
+    assert len(streets) == np.count_nonzero(genome)
+    assert (timings == 1).all()
@@ -5,62 +5,47 @@ Created on Sat May  1 08:10:36 2021
 @author: Glenn
 """
 
-from collections import defaultdict
 from simulation_classes import Simulation
 from evo_classes import Population
+from network import RoadNetwork
+from instrumentation import profiler
 import matplotlib.pyplot as plt
 
 
-def parse_input(filename):
+def parse_input(filename, cache=True):
+    # Compile the file into a RoadNetwork, which is read from its binary cache
+    # when the file has not changed, and convert it to street names.
+    network = RoadNetwork.from_file(filename, cache=cache)
+    names = network.street_names
+
     # Create dict to hold streets
-    street_dict = defaultdict(tuple)
+    street_dict = dict(
+        zip(names, zip(network.street_end.tolist(), network.street_length.tolist()))
+    )
     # Create list to hold all paths
-    paths = []
+    paths = [[names[street] for street in path] for path in network.path_lists()]
     # Create dict to hold all intersections for crossover purposes
-    intersection_dict = defaultdict(list)
+    intersection_dict = network.intersection_dict()
 
-    # Read in file
-    with open(filename, "r") as f:
-        content = f.readlines()
+    return street_dict, paths, network.nr_iters, network.score_per_car, intersection_dict
 
-    # Parse first line to extract sim parameters
-    parameters = list(map(int, content[0].split()))
 
-    D = parameters[0]  # number of iterations in simulation
-    # I = parameters[1] # number of intersections
-    S = parameters[2]  # number of streets
-    # V = parameters[3] # number of vehicles
-    F = parameters[4]  # score per vehicle getting to destination
+def create_default_sim_from_file(filename):
+    S, P, D, F, I = parse_input(filename)
+    sim = Simulation(S, P, F, D)
 
-    # Parse street info
-    for line in content[1 : 1 + S]:
-        # Parse line elements
-        l = line.split()
-        fr = int(l[0])
-        to = int(l[1])
-        name = l[2]
-        length = int(l[3])
+    return sim, I
 
-        # Store information in dicts
-        street_dict[name] = (to, length)
-        if not (fr in intersection_dict[to]):
-            intersection_dict[to].append(fr)
-            intersection_dict[fr].append(to)
 
-    # Parse path info
-    for line in content[1 + S :]:
-        # Parse line elements
-        l = line.split()
-        paths.append(l[1:])
+def load_network(filename, cache=True):
+    # Compile a city plan file into an integer indexed RoadNetwork.
+    return RoadNetwork.from_file(filename, cache=cache)
 
-    return street_dict, paths, D, F, intersection_dict
 
+def create_sim_from_network(network):
+    sim = Simulation.from_network(network)
 
-def create_default_sim_from_file(filename):
-    S, P, D, F, I = parse_input(filename)
-    sim = Simulation(S, P, F, D)
-
-    return sim, I
+    return sim, network.intersection_dict()
 
 
 def create_population_from_file(filename):
@@ -77,12 +62,47 @@ def plot_evolutionary_run(
     fig_no=1,
     fig_title="Performance of individuals across all generations.",
 ):
-    plt.figure(fig_no)
-    plt.plot(best, "r-", label="Best")
-    plt.plot(worst, "b-", label="Worst")
-    plt.plot(mean, "g-", label="Mean")
-    plt.xlabel("Generation number")
-    plt.ylabel("Score")
-    plt.title(fig_title)
-    plt.legend()
-    plt.show()
+    with profiler.phase("plot"):
+        plt.figure(fig_no)
+        plt.plot(best, "r-", label="Best")
+        plt.plot(worst, "b-", label="Worst")
+        plt.plot(mean, "g-", label="Mean")
+        plt.xlabel("Generation number")
+        plt.ylabel("Score")
+        plt.title(fig_title)
+        plt.legend()
+        plt.show()
+
+
+def plot_steady_state_run(
+    times,
+    best,
+    fig_no=1,
+    fig_title="Best individual over wall-clock time.",
+):
+    with profiler.phase("plot"):
+        plt.figure(fig_no)
+        plt.plot(times, best, "r-", label="Best")
+        plt.xlabel("Wall-clock time (s)")
+        plt.ylabel("Score")
+        plt.title(fig_title)
+        plt.legend()
+        plt.show()
+
+
+def plot_island_run(
+    island_best,
+    global_best,
+    fig_no=1,
+    fig_title="Best individual per island across all generations.",
+):
+    with profiler.phase("plot"):
+        plt.figure(fig_no)
+        for island, best in enumerate(island_best):
+            plt.plot(best, "-", alpha=0.5, label=f"Island {island}")
+        plt.plot(global_best, "r-", label="Global best")
+        plt.xlabel("Generation number")
+        plt.ylabel("Score")
+        plt.title(fig_title)
+        plt.legend()
+        plt.show()